@@ -1,7 +1,29 @@
+import hashlib
+import json
+import os
 import regex as re
+import heapq
 import logging
+import mmap
+import multiprocessing
+import sys
+import time
+from array import array
+from collections import Counter, defaultdict
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
 from concurrent.futures import ProcessPoolExecutor
-from collections import Counter
+from itertools import chain, repeat
+from typing import BinaryIO
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
 
 # Set up logging to show INFO and above
 logging.basicConfig(
@@ -10,7 +32,9 @@ logging.basicConfig(
 )
 
 logger = logging.getLogger(__name__)
-logger.disabled = True
+
+# Target size of the chunks a corpus file is read in during pretokenization
+DEFAULT_CHUNK_SIZE = 64 * 1024 * 1024
 
 PAT = re.compile(r"""'(?:[sdmt]|ll|ve|re)| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+""")
 
@@ -27,6 +51,32 @@ def init_vocab(special_tokens: list) -> dict[int, bytes]:
 
     return vocab
 
+@lru_cache(maxsize=32)
+def _compile_special_tokens(special_tokens: tuple[str, ...]) -> re.Pattern:
+    # Longest first, so a special token that contains another one wins
+    alternation = "|".join(re.escape(token) for token in sorted(special_tokens, key=len, reverse=True))
+    return re.compile(f"({alternation})")
+
+
+def special_token_pattern(special_tokens: Iterable[str]) -> re.Pattern | None:
+    """
+    One compiled, escaped alternation matching any of `special_tokens`, or None
+    if there are none.
+
+    The alternation is inside a capturing group, so `pattern.split(text)` keeps
+    the matched special tokens at the odd positions. Patterns are cached, so
+    calling this once per chunk of text costs a dict lookup.
+    """
+    special_tokens = tuple(dict.fromkeys(special_tokens))
+    return _compile_special_tokens(special_tokens) if special_tokens else None
+
+
+def split_special_tokens(text: str, special_tokens: Iterable[str]) -> list[str]:
+    # The text between special tokens, found in a single pass however many tokens there are
+    pattern = special_token_pattern(special_tokens)
+    return pattern.split(text)[::2] if pattern is not None else [text]
+
+
 # "Helllow owjrld world"
 def pretokenization(text : str, special_tokens: list[str]) -> list[list[bytes]]:
 
@@ -64,14 +114,7 @@ def pretokenization(text : str, special_tokens: list[str]) -> list[list[bytes]]:
     # ===============
 
     pre_tokens_bytes = []
-    chunks = [text]
-    for token in special_tokens:
-        new_chunks = []
-        for chunk in chunks:
-            new_chunks.extend(chunk.split(token))
-        chunks = new_chunks
-
-    for chunk in chunks:
+    for chunk in split_special_tokens(text, special_tokens):
         for match in PAT.finditer(chunk):
             token = match.group().encode("utf-8")
             pre_tokens_bytes.append(
@@ -80,34 +123,191 @@ def pretokenization(text : str, special_tokens: list[str]) -> list[list[bytes]]:
     return pre_tokens_bytes
 
 
-def pretokenization_chunk(text_chunk : str) -> list[list[bytes]]:
-
-    # pre tokenization
-    PAT = r"""'(?:[sdmt]|ll|ve|re)| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
-
-    # Get a list of pre tokens using the pattern above
-    pre_tokens_iterator = re.finditer(PAT, text_chunk)
-    pre_tokens = [match.group().encode('utf-8') for match in pre_tokens_iterator]
-
- 
-    # break down each pre token into one byte chunk - b'H'
-    pre_tokens_bytes = []
-    for token in pre_tokens:
-        pre_tokens_bytes.append([bytes([id]) for id in token])
+def count_pretokens(text: str, special_tokens: list[str]) -> Counter:
+    # Frequency table of pretoken bytes; special tokens act as hard boundaries and are not counted
+    counts = Counter()
+    for chunk in split_special_tokens(text, special_tokens):
+        counts.update(match.group() for match in PAT.finditer(chunk))
+
+    # encode each distinct pretoken once rather than every occurrence
+    return Counter({pretoken.encode("utf-8"): freq for pretoken, freq in counts.items()})
+
+
+def open_mapping(input_path: str | os.PathLike) -> mmap.mmap | bytes:
+    # Read-only mapping of the whole file, valid after the file is closed;
+    # empty files cannot be mapped and stand in as b""
+    with open(input_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+@contextmanager
+def map_file(input_path: str | os.PathLike) -> Iterator[mmap.mmap | bytes]:
+    mapped = open_mapping(input_path)
+    try:
+        yield mapped
+    finally:
+        if isinstance(mapped, mmap.mmap):
+            mapped.close()
+
+
+def decode_range(mapped: mmap.mmap | bytes, start: int, end: int) -> str:
+    # Decode straight out of the mapping; the slice is a view, not a copy of the bytes
+    with memoryview(mapped) as view, view[start:end] as chunk:
+        return str(chunk, "utf-8", errors="ignore")
+
+
+def _special_token_cut(mapped: mmap.mmap | bytes, position: int, pattern: re.Pattern, max_len: int) -> int:
+    """
+    First offset at or after `position` where a special token starts and no
+    special token reaches across, or the end of `mapped`.
+
+    A match found from an arbitrary offset can be the tail of a longer special
+    token (`<|eot|>` inside `[doc]<|eot|>`, or the second half of a doubled
+    token), so the `max_len - 1` bytes before each candidate are checked for a
+    longest-first match that ends past it. Cutting only where nothing reaches
+    across means each piece splits exactly as it would inside the whole file.
+    """
+    while (match := pattern.search(mapped, position)) is not None:
+        cut = match.start()
+        reaching = (pattern.match(mapped, i) for i in range(max(0, cut - max_len + 1), cut))
+        if all(m is None or m.end() <= cut for m in reaching):
+            return cut
+        position = cut + 1
+    return len(mapped)
+
+
+def file_chunk_boundaries(input_path: str | os.PathLike, special_tokens: list[str],
+                          num_chunks: int) -> list[int]:
+    """
+    Byte offsets that cut `input_path` into about `num_chunks` pieces.
+
+    Each evenly spaced guess is moved forward to the start of the next special
+    token that no longer special token reaches across (see `_special_token_cut`), so no
+    pretoken or special token straddles two chunks. Without special tokens there
+    is no safe place to cut and the whole file is a single chunk.
+    """
+    with map_file(input_path) as mapped:
+        if not special_tokens or not mapped:
+            return [0, len(mapped)]
+        # longest first, like `special_token_pattern`, but over the raw bytes
+        tokens = sorted({token.encode("utf-8") for token in special_tokens}, key=len, reverse=True)
+        pattern = re.compile(b"|".join(map(re.escape, tokens)))
+        chunk_size = len(mapped) // num_chunks
+        boundaries = {0, len(mapped)}
+        boundaries.update(_special_token_cut(mapped, i * chunk_size, pattern, len(tokens[0]))
+                          for i in range(1, num_chunks))
+        return sorted(boundaries)
+
+
+def iter_file_chunks(input_path: str | os.PathLike, special_tokens: list[str],
+                     chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[str]:
+    # Yield the decoded text of `input_path` one ~chunk_size piece at a time
+    num_chunks = max(1, os.path.getsize(input_path) // chunk_size)
+    boundaries = file_chunk_boundaries(input_path, special_tokens, num_chunks)
+    with map_file(input_path) as mapped:
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            yield decode_range(mapped, start, end)
+
+
+def count_pretokens_from_file(input_path: str | os.PathLike, special_tokens: list[str],
+                              chunk_size: int = DEFAULT_CHUNK_SIZE) -> Counter:
+    # Only one chunk of text is alive at a time; the running table holds distinct pretokens
+    pretoken_counts = Counter()
+    for chunk in iter_file_chunks(input_path, special_tokens, chunk_size):
+        pretoken_counts.update(count_pretokens(chunk, special_tokens))
+    return pretoken_counts
+
+
+# Each pretokenization worker maps the corpus once, in the pool initializer; the
+# mappings of all workers share the same pages of the OS cache
+_worker_mapped = None
+
+
+def _init_mapped_worker(input_path: str | os.PathLike) -> None:
+    global _worker_mapped
+    _worker_mapped = open_mapping(input_path)
+
+
+def _count_pretokens_in_range(start: int, end: int, special_tokens: list[str]) -> Counter:
+    # Runs in a worker: decode the byte range from its mapping so only offsets and counts cross processes
+    return count_pretokens(decode_range(_worker_mapped, start, end), special_tokens)
+
+
+def pretokenize_parallel(input_path: str | os.PathLike, special_tokens: list[str], num_workers: int = 1,
+                         chunk_size: int = DEFAULT_CHUNK_SIZE) -> Counter:
+    """
+    Count pretokens of `input_path` across a process pool.
+
+    Workers map the file once and are then handed (start, end) byte offsets into
+    it; each sends back a pretoken frequency table, which the parent sums. There are at least
+    `num_workers` chunks, and more for large files so each stays near `chunk_size`.
+    """
+    num_chunks = max(num_workers, os.path.getsize(input_path) // chunk_size)
+    boundaries = file_chunk_boundaries(input_path, special_tokens, num_chunks)
+
+    pretoken_counts = Counter()
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_mapped_worker,
+                             initargs=(input_path,)) as exe:
+        for counts in exe.map(_count_pretokens_in_range, boundaries[:-1], boundaries[1:],
+                              repeat(special_tokens)):
+            pretoken_counts.update(counts)
+
+    return pretoken_counts
+
+
+def pretoken_cache_key(input_path: str | os.PathLike, special_tokens: list[str]) -> str:
+    """
+    Fingerprint of everything a pretoken table depends on: the corpus contents,
+    the special tokens and the pretokenization regex.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(input_path, "rb") as f:
+        while block := f.read(1 << 23):
+            digest.update(block)
+    digest.update(json.dumps(special_tokens).encode("utf-8"))
+    digest.update(PAT.pattern.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def save_pretoken_counts(path: str | os.PathLike, pretoken_counts: Counter) -> None:
+    # One bytes blob with offsets plus a count array
+    offsets, blob = _pack_bytes(list(pretoken_counts.keys()))
+    counts = np.fromiter(pretoken_counts.values(), dtype=np.int64, count=len(pretoken_counts))
+    _atomic_savez(path, blob=blob, offsets=offsets, counts=counts)
+
+
+def load_pretoken_counts(path: str | os.PathLike) -> Counter:
+    with np.load(path) as table:
+        pretokens = _unpack_bytes(table["offsets"], table["blob"])
+        counts = table["counts"].tolist()
+    return Counter(dict(zip(pretokens, counts)))
+
+
+def cached_pretoken_counts(input_path: str | os.PathLike, special_tokens: list[str],
+                           cache_dir: str | os.PathLike, num_workers: int = 1,
+                           chunk_size: int = DEFAULT_CHUNK_SIZE) -> Counter:
+    """
+    Pretoken table of `input_path`, computed once and then loaded from `cache_dir`.
+
+    Tables are keyed by `pretoken_cache_key`, so sweeping `vocab_size` over the
+    same corpus only pays for pretokenization on the first run, while editing the
+    corpus, the special tokens or `PAT` produces a fresh table.
+    """
+    cache_path = os.path.join(cache_dir, f"pretokens-{pretoken_cache_key(input_path, special_tokens)}.npz")
+    if os.path.exists(cache_path):
+        logger.info(f"Loading pretoken table from {cache_path}")
+        return load_pretoken_counts(cache_path)
 
-    return pre_tokens_bytes
-
-
-def pretokenize_parallel(text_corpus: str, special_token: str, num_workers: int =1) -> list[list[bytes]]:
-
-    text_chunks = text_corpus.split(special_token)
-    all_tokens = []
-
-    with ProcessPoolExecutor(max_workers=num_workers) as exe:
-        for chunk_token in exe.map(pretokenization_chunk, text_chunks):
-            all_tokens.extend(chunk_token)
+    if num_workers > 1:
+        pretoken_counts = pretokenize_parallel(input_path, special_tokens, num_workers, chunk_size)
+    else:
+        pretoken_counts = count_pretokens_from_file(input_path, special_tokens, chunk_size)
 
-    return all_tokens
+    os.makedirs(cache_dir, exist_ok=True)
+    save_pretoken_counts(cache_path, pretoken_counts)
+    return pretoken_counts
 
 
 def get_pair_freq_counts(pre_tokens_bytes: Counter) -> dict[tuple[bytes], int]:
@@ -144,6 +344,298 @@ def merge(old_tokens: Counter, top_pair) -> Counter:
     return new_tokens
 
 
+def count_pairs(words: list[array], word_freqs: list[int]) -> tuple[Counter, defaultdict]:
+    """
+    Weighted adjacent-pair counts and the pair -> word ids index, computed with NumPy.
+
+    All words are packed into one flat id array; positions whose right neighbour
+    belongs to the same word form a pair, encoded as a single 64-bit key
+    `(left << 32) | right`. Sorting the keys (together with the word ids) lets
+    one `reduceat` sum the word frequencies per pair and gives each pair's
+    distinct word ids as a contiguous run.
+    """
+    lengths = np.fromiter((len(word) for word in words), dtype=np.int64, count=len(words))
+    flat = np.fromiter(chain.from_iterable(words), dtype=np.uint64, count=int(lengths.sum()))
+    word_ids = np.repeat(np.arange(len(words), dtype=np.int64), lengths)
+
+    same_word = word_ids[:-1] == word_ids[1:]
+    keys = ((flat[:-1] << np.uint64(32)) | flat[1:])[same_word]
+    pair_word_ids = word_ids[:-1][same_word]
+
+    pair_freqs = Counter()
+    pair_to_words = defaultdict(set)
+    if keys.size == 0:
+        return pair_freqs, pair_to_words
+
+    order = np.lexsort((pair_word_ids, keys))
+    keys = keys[order]
+    pair_word_ids = pair_word_ids[order]
+    weights = np.asarray(word_freqs, dtype=np.int64)[pair_word_ids]
+
+    new_key = np.empty(keys.size, dtype=bool)
+    new_key[0] = True
+    np.not_equal(keys[1:], keys[:-1], out=new_key[1:])
+    key_starts = np.flatnonzero(new_key)
+    unique_keys = keys[key_starts]
+    counts = np.add.reduceat(weights, key_starts)
+
+    # a word holding the same pair twice only needs to appear once in the index
+    new_entry = new_key.copy()
+    new_entry[1:] |= pair_word_ids[1:] != pair_word_ids[:-1]
+    entry_keys = keys[new_entry]
+    entry_word_ids = pair_word_ids[new_entry].tolist()
+    entry_starts = np.flatnonzero(np.r_[True, entry_keys[1:] != entry_keys[:-1]]).tolist()
+    entry_starts.append(len(entry_word_ids))
+
+    lefts = (unique_keys >> np.uint64(32)).tolist()
+    rights = (unique_keys & np.uint64(0xFFFFFFFF)).tolist()
+    for j, (pair, freq) in enumerate(zip(zip(lefts, rights), counts.tolist())):
+        pair_freqs[pair] = freq
+        pair_to_words[pair] = set(entry_word_ids[entry_starts[j]:entry_starts[j + 1]])
+
+    return pair_freqs, pair_to_words
+
+
+def build_merge_ranks(token_to_id: dict[bytes, int],
+                      merges: list[tuple[bytes, bytes]]) -> dict[tuple[int, int], tuple[int, int]]:
+    # (left id, right id) -> (rank, merged id); a repeated merge keeps its first rank
+    merge_ranks = {}
+    for rank, (left, right) in enumerate(merges):
+        pair = (token_to_id[left], token_to_id[right])
+        if pair not in merge_ranks:
+            merge_ranks[pair] = (rank, token_to_id[left + right])
+    return merge_ranks
+
+
+def apply_merge_ranks(ids: list[int], merge_ranks: dict[tuple[int, int], tuple[int, int]]) -> list[int]:
+    """
+    Merge the lowest-ranked adjacent pair of `ids` until no pair has a rank.
+
+    A token only appears in merges ranked after the one that created it, so this
+    gives the same ids as replaying every merge in order, while only looking at
+    the pairs actually present.
+    """
+    while len(ids) > 1:
+        best = None
+        for pair in zip(ids, ids[1:]):
+            ranked = merge_ranks.get(pair)
+            if ranked is not None and (best is None or ranked[0] < best[1][0]):
+                best = (pair, ranked)
+        if best is None:
+            break
+
+        (left, right), (_, merged_id) = best
+        merged = []
+        i = 0
+        n = len(ids)
+        while i < n:
+            if i + 1 < n and ids[i] == left and ids[i + 1] == right:
+                merged.append(merged_id)
+                i += 2
+            else:
+                merged.append(ids[i])
+                i += 1
+        ids = merged
+
+    return ids
+
+
+class _ReversedPair:
+    """Orders pairs in reverse so a min-heap pops the lexicographically greatest pair first."""
+    __slots__ = ("pair",)
+
+    def __init__(self, pair):
+        self.pair = pair
+
+    def __lt__(self, other):
+        return self.pair > other.pair
+
+    def __eq__(self, other):
+        return self.pair == other.pair
+
+
+class PairHeap:
+    """
+    Max-heap over pair frequencies with lazy deletion.
+
+    Entries are never updated in place: whenever the count of a pair changes the
+    caller pushes it again, and stale entries (whose count no longer matches
+    `pair_freqs`) are discarded when they reach the top. Ties on count are broken
+    by the greater pair, the same order as `max(..., key=lambda x: (x[1], x[0]))`.
+    When pairs are token ids, pass `vocab` so ties compare the underlying bytes.
+    """
+
+    def __init__(self, pair_freqs: Counter, vocab: dict[int, bytes] | None = None):
+        self.pair_freqs = pair_freqs
+        self.vocab = vocab
+        self.heap = [(-freq, self._tiebreak(pair), pair) for pair, freq in pair_freqs.items() if freq > 0]
+        heapq.heapify(self.heap)
+
+    def _tiebreak(self, pair) -> _ReversedPair:
+        if self.vocab is None:
+            return _ReversedPair(pair)
+        return _ReversedPair((self.vocab[pair[0]], self.vocab[pair[1]]))
+
+    def push(self, pair) -> None:
+        freq = self.pair_freqs.get(pair, 0)
+        if freq > 0:
+            heapq.heappush(self.heap, (-freq, self._tiebreak(pair), pair))
+
+    def pop_max(self):
+        # Returns the most frequent pair, or None once no pair is left
+        heap = self.heap
+        while heap:
+            neg_freq, _, pair = heapq.heappop(heap)
+            if self.pair_freqs.get(pair, 0) == -neg_freq:
+                return pair
+        return None
+
+
+def merge_words(word_ids: Iterable[int], words: list[array], word_freqs: list[int], pair_to_words: defaultdict,
+                top_pair: tuple[int, int], p0p1: int) -> Counter:
+    """
+    Replace `top_pair` by the token `p0p1` in the given words, in place.
+
+    `pair_to_words` is kept in sync, and the change in pair counts is returned as
+    pair -> delta, to be added to the running counts by the caller.
+    """
+    p0, p1 = top_pair
+    pair_deltas = Counter()
+
+    for word_id in word_ids:
+        pretoken_tuple = words[word_id]
+        freq = word_freqs[word_id]
+        new_token = []
+        i = 0
+
+        n = len(pretoken_tuple)
+        while i < n:
+            if i + 1 < n and pretoken_tuple[i] == p0 and pretoken_tuple[i+1] == p1:
+                if new_token:
+                    left = new_token[-1]
+                    pair_deltas[(left, p0p1)] += freq
+                    pair_deltas[(left, p0)] -= freq
+
+                if i + 2 < n:
+                    right = pretoken_tuple[i+2]
+                    pair_deltas[(p0p1, right)] += freq
+                    pair_deltas[(p1, right)] -= freq
+
+                pair_deltas[top_pair] -= freq
+
+                new_token.append(p0p1)
+                i+=2
+
+            else:
+                new_token.append(pretoken_tuple[i])
+                i+=1
+
+        new_token = array("I", new_token)
+        words[word_id] = new_token
+
+        # keep the index in sync with the pairs this word gained and lost
+        old_pairs = set(zip(pretoken_tuple, pretoken_tuple[1:]))
+        new_pairs = set(zip(new_token, new_token[1:]))
+        for pair in old_pairs - new_pairs:
+            if pair != top_pair:
+                pair_to_words[pair].discard(word_id)
+        for pair in new_pairs - old_pairs:
+            pair_to_words[pair].add(word_id)
+
+    return pair_deltas
+
+
+def _merge_shard_worker(conn, words: list[array], word_freqs: list[int]) -> None:
+    # Runs in a worker process: count pairs of one shard, then apply merges as they arrive
+    pair_freqs, pair_to_words = count_pairs(words, word_freqs)
+    conn.send(pair_freqs)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            # the coordinator went away without closing us
+            return
+        if message is None:
+            return
+        if message == "words":
+            conn.send(words)
+            continue
+        top_pair, p0p1 = message
+        word_ids = pair_to_words.pop(top_pair, ())
+        conn.send(merge_words(word_ids, words, word_freqs, pair_to_words, top_pair, p0p1))
+
+
+class MergeShards:
+    """
+    The pretoken table split into contiguous shards, each owned by a worker process.
+
+    Every worker keeps the words of its shard and their pair index. For each merge
+    the coordinator sends (top pair, new id) to all of them, they rewrite their
+    words concurrently and send back pair-count deltas, which are summed here.
+    Since integer deltas add up to the same totals in any order, the coordinator's
+    pair counts, and so the merges picked from them, match the serial loop.
+
+    Every merge costs one round trip per worker, so this only pays off when a
+    merge touches many words, i.e. for large pretoken tables.
+    """
+
+    def __init__(self, words: list[array], word_freqs: list[int], num_workers: int):
+        per_worker = -(-len(words) // num_workers)
+        ctx = multiprocessing.get_context()
+        self.connections = []
+        self.processes = []
+        for start in range(0, max(len(words), 1), per_worker or 1):
+            conn, child_conn = ctx.Pipe()
+            process = ctx.Process(
+                target=_merge_shard_worker,
+                args=(child_conn, words[start:start + per_worker], word_freqs[start:start + per_worker]),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self.connections.append(conn)
+            self.processes.append(process)
+
+        self.pair_freqs = Counter()
+        for conn in self.connections:
+            self.pair_freqs.update(conn.recv())
+
+    def merge(self, top_pair: tuple[int, int], p0p1: int) -> Counter:
+        for conn in self.connections:
+            conn.send((top_pair, p0p1))
+        pair_deltas = Counter()
+        for conn in self.connections:
+            pair_deltas.update(conn.recv())
+        return pair_deltas
+
+    def gather_words(self) -> list[array]:
+        # The current words of every shard, in the original order
+        for conn in self.connections:
+            conn.send("words")
+        return [word for conn in self.connections for word in conn.recv()]
+
+    def close(self) -> None:
+        # Safe to call more than once, and after a worker died or a merge was interrupted
+        for conn in self.connections:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            conn.close()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.connections, self.processes = [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 # def train_bpe(text: str, special_tokens:list[str], vocab_size:int, num_workers: int = 1):
 
 #     # # Remove special tokens from the text
@@ -207,104 +699,392 @@ def merge(old_tokens: Counter, top_pair) -> Counter:
 
 
 
-def train_bpe(text: str, vocab_size:int, special_tokens:list[str],  num_workers: int = 1):
+def _pack_bytes(items: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+    # (offsets, blob) arrays: item i is blob[offsets[i]:offsets[i + 1]]
+    lengths = np.fromiter(map(len, items), dtype=np.int64, count=len(items))
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return offsets, np.frombuffer(b"".join(items), dtype=np.uint8)
+
+
+def _unpack_bytes(offsets: np.ndarray, blob: np.ndarray) -> list[bytes]:
+    # Inverse of _pack_bytes, slicing a single copy of the blob
+    data = blob.tobytes()
+    offsets = offsets.tolist()
+    return [data[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def _pack_vocab(vocab: dict[int, bytes]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # vocab as (ids, offsets into one blob, blob) arrays
+    ids = np.fromiter(vocab.keys(), dtype=np.int64, count=len(vocab))
+    return ids, *_pack_bytes(list(vocab.values()))
+
+
+def _unpack_vocab(ids: np.ndarray, offsets: np.ndarray, blob: np.ndarray) -> dict[int, bytes]:
+    return dict(zip(ids.tolist(), _unpack_bytes(offsets, blob)))
+
+
+@contextmanager
+def _atomic_write(path: str | os.PathLike) -> Iterator[BinaryIO]:
+    # Write next to `path` and rename over it, so a crash mid-write never leaves a truncated file
+    tmp_path = f"{os.fspath(path)}.tmp"
+    with open(tmp_path, "wb") as f:
+        yield f
+    os.replace(tmp_path, path)
+
+
+def _atomic_savez(path: str | os.PathLike, **arrays: np.ndarray) -> None:
+    # An uncompressed .npz of `arrays`, written with _atomic_write
+    with _atomic_write(path) as f:
+        np.savez(f, **arrays)
+
+
+def save_bpe_state(path: str | os.PathLike, words: list[array], word_freqs: list[int],
+                   vocab: dict[int, bytes], merge_ids: list[tuple[int, int]]) -> None:
+    """
+    Snapshot the BPE training state as an uncompressed `.npz` of flat arrays.
+
+    The pretoken table is stored as one id array plus offsets and frequencies, the
+    vocab as offsets into a single bytes blob, and merges as pairs of token ids.
+    Pair counts and the pair index are rebuilt from the pretokens on load with
+    `count_pairs`, which takes seconds, so they are not stored. The file is
+    written next to `path` and renamed over it, so a crash mid-write never leaves
+    a truncated snapshot behind.
+    """
+    # each word's raw uint32 ids, packed like any other bytes and viewed back as ids
+    word_offsets, word_blob = _pack_bytes([word.tobytes() for word in words])
+    vocab_ids, vocab_offsets, vocab_blob = _pack_vocab(vocab)
+    _atomic_savez(
+        path,
+        word_ids=word_blob.view(np.uint32),
+        word_offsets=word_offsets // 4,
+        word_freqs=np.asarray(word_freqs, dtype=np.int64),
+        vocab_ids=vocab_ids,
+        vocab_offsets=vocab_offsets,
+        vocab_blob=vocab_blob,
+        merge_ids=np.asarray(merge_ids, dtype=np.uint32).reshape(-1, 2),
+    )
+
+
+def load_bpe_state(path: str | os.PathLike) -> tuple[list[array], list[int], dict[int, bytes], list[tuple[int, int]]]:
+    # Inverse of save_bpe_state: (words, word_freqs, vocab, merge_ids)
+    with np.load(path) as state:
+        # array("I", raw) reads each word's bytes back as uint32 ids
+        raw_words = _unpack_bytes(state["word_offsets"] * 4, state["word_ids"].view(np.uint8))
+        words = [array("I", word) for word in raw_words]
+        word_freqs = state["word_freqs"].tolist()
+        vocab = _unpack_vocab(state["vocab_ids"], state["vocab_offsets"], state["vocab_blob"])
+        merge_ids = [tuple(pair) for pair in state["merge_ids"].tolist()]
+    return words, word_freqs, vocab, merge_ids
+
+
+def peak_rss_bytes(include_children: bool = False) -> int:
+    """
+    High-water mark of this process' resident memory, 0 where it cannot be read.
+
+    With `include_children`, the largest waited-for child process (e.g. a pool
+    worker) counts too, whichever is bigger.
+    """
+    if resource is None:
+        return 0
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is in KiB on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if include_children:
+        peak = max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak * scale
+
+
+@dataclass
+class BPEProgress:
+    phase: str
+    merges_done: int
+    merges_total: int
+    elapsed_seconds: float
+    phase_seconds: dict[str, float]
+    merges_per_sec: float
+    num_pairs: int
+    num_pretokens: int
+    peak_rss_bytes: int
+    eta_seconds: float | None
+
+
+def log_progress(progress: BPEProgress) -> None:
+    eta = f"{progress.eta_seconds:.0f}s" if progress.eta_seconds is not None else "?"
+    logger.info(
+        f"[{progress.phase}] {progress.merges_done}/{progress.merges_total} merges, "
+        f"{progress.merges_per_sec:.1f} merges/s, ETA {eta}, {progress.num_pairs} pairs, "
+        f"{progress.num_pretokens} pretokens, peak RSS {progress.peak_rss_bytes / 2**20:.0f} MiB"
+    )
+
+
+@dataclass
+class TrainingMonitor:
+    """
+    Times the phases of a BPE training run and reports `BPEProgress` snapshots.
+
+    `callback` is called when a phase ends and every `report_every` merges during
+    the merge loop (never, with `report_every=0`); it defaults to logging through
+    this module's logger. Reports only read counters that are already maintained,
+    so the monitor can stay on. The merge rate and ETA count only the merges made
+    since the "merge" phase started, not those restored from a checkpoint or an
+    existing merge list.
+    """
+    callback: Callable[[BPEProgress], None] = log_progress
+    report_every: int = 1000
+    phase: str | None = None
+    phase_seconds: dict[str, float] = field(default_factory=dict)
+
+    def __post_init__(self):
+        if self.report_every < 0:
+            raise ValueError(f"report_every must be >= 0, got {self.report_every}")
+        self.started = time.perf_counter()
+        self.phase_started = self.started
+        self.merges_before = 0
+
+    def start_phase(self, phase: str, merges_done: int = 0) -> None:
+        now = time.perf_counter()
+        if self.phase is not None:
+            self.phase_seconds[self.phase] = self.phase_seconds.get(self.phase, 0.0) + now - self.phase_started
+        self.phase = phase
+        self.phase_started = now
+        if phase == "merge":
+            self.merges_before = merges_done
+
+    def report(self, merges_done: int = 0, merges_total: int = 0, num_pairs: int = 0,
+               num_pretokens: int = 0) -> BPEProgress:
+        now = time.perf_counter()
+        phase_seconds = dict(self.phase_seconds)
+        if self.phase is not None:
+            phase_seconds[self.phase] = phase_seconds.get(self.phase, 0.0) + now - self.phase_started
+
+        merge_seconds = phase_seconds.get("merge", 0.0)
+        merges_per_sec = (merges_done - self.merges_before) / merge_seconds if merge_seconds > 0 else 0.0
+        eta_seconds = (merges_total - merges_done) / merges_per_sec if merges_per_sec > 0 else None
+
+        progress = BPEProgress(
+            phase=self.phase or "",
+            merges_done=merges_done,
+            merges_total=merges_total,
+            elapsed_seconds=now - self.started,
+            phase_seconds=phase_seconds,
+            merges_per_sec=merges_per_sec,
+            num_pairs=num_pairs,
+            num_pretokens=num_pretokens,
+            peak_rss_bytes=peak_rss_bytes(),
+            eta_seconds=eta_seconds,
+        )
+        self.callback(progress)
+        return progress
+
+
+def train_bpe(text: str, vocab_size:int, special_tokens:list[str],  num_workers: int = 1,
+              monitor: TrainingMonitor | None = None, checkpoint_path: str | os.PathLike | None = None,
+              checkpoint_every: int = 0, resume_from: str | os.PathLike | None = None,
+              vocab: dict[int, bytes] | None = None, merges: list[tuple[bytes, bytes]] | None = None,
+              merge_workers: int = 1):
 
     # # Remove special tokens from the text
     # for token in special_tokens:
     #     text = text.replace(token, "")
 
-    vocab = init_vocab(special_tokens)
-    # initial merges - ordered from earliest-created to latest
-    merges = []
-
+    merge_options = dict(checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every,
+                         merge_workers=merge_workers)
+    if resume_from is not None:
+        # the snapshot already holds the pretoken table
+        return train_bpe_from_pretokens(None, vocab_size, special_tokens, monitor, resume_from=resume_from,
+                                        **merge_options)
 
-    # logger.info(f"No of merges that are required to achieve vocab size {vocab_size} is {no_of_merges}")
+    if monitor is not None:
+        monitor.start_phase("pretokenize")
 
     # Pretokenization
-    if num_workers > 1:
-        tokens_list = pretokenize_parallel(text, '<|endoftext|>', num_workers)
+    if num_workers > 1 and special_tokens:
+        # hand each worker a slice of whole documents and sum the tables they return
+        docs = text.split(special_tokens[0])
+        per_worker = -(-len(docs) // num_workers)
+        chunks = [special_tokens[0].join(docs[i:i + per_worker]) for i in range(0, len(docs), per_worker)]
+        pretoken_counts = Counter()
+        with ProcessPoolExecutor(max_workers=num_workers) as exe:
+            for counts in exe.map(count_pretokens, chunks, repeat(special_tokens)):
+                pretoken_counts.update(counts)
     else:
-        tokens_list = pretokenization(text, special_tokens)
-
-    tokens = Counter(tuple(tok) for tok in tokens_list)
+        pretoken_counts = count_pretokens(text, special_tokens)
+
+    return train_bpe_from_pretokens(pretoken_counts, vocab_size, special_tokens, monitor, vocab=vocab,
+                                    merges=merges, **merge_options)
+
+
+def train_bpe_from_file(input_path: str | os.PathLike, vocab_size: int, special_tokens: list[str],
+                        num_workers: int = 1, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                        monitor: TrainingMonitor | None = None, checkpoint_path: str | os.PathLike | None = None,
+                        checkpoint_every: int = 0, resume_from: str | os.PathLike | None = None,
+                        cache_dir: str | os.PathLike | None = None, vocab: dict[int, bytes] | None = None,
+                        merges: list[tuple[bytes, bytes]] | None = None, merge_workers: int = 1):
+    """
+    Train BPE on the file at `input_path` without loading it into memory.
+
+    The file is read one special-token-aligned chunk at a time and reduced to a
+    pretoken frequency table, so peak memory follows the number of distinct
+    pretokens rather than the size of the corpus. With `num_workers > 1` the
+    chunks are counted in a process pool. With `cache_dir`, the pretoken table is
+    reused across runs on the same corpus (see `cached_pretoken_counts`).
+
+    See `train_bpe_from_pretokens` for checkpointing, parallel merging and
+    extending an existing `vocab`/`merges`; when resuming, the file is not read again.
+    """
+    merge_options = dict(checkpoint_path=checkpoint_path, checkpoint_every=checkpoint_every,
+                         merge_workers=merge_workers)
+    if resume_from is not None:
+        return train_bpe_from_pretokens(None, vocab_size, special_tokens, monitor, resume_from=resume_from,
+                                        **merge_options)
+
+    if monitor is not None:
+        monitor.start_phase("pretokenize")
+    if cache_dir is not None:
+        pretoken_counts = cached_pretoken_counts(input_path, special_tokens, cache_dir, num_workers, chunk_size)
+    elif num_workers > 1:
+        pretoken_counts = pretokenize_parallel(input_path, special_tokens, num_workers, chunk_size)
+    else:
+        pretoken_counts = count_pretokens_from_file(input_path, special_tokens, chunk_size)
+    return train_bpe_from_pretokens(pretoken_counts, vocab_size, special_tokens, monitor, vocab=vocab,
+                                    merges=merges, **merge_options)
+
+
+def train_bpe_from_pretokens(pretoken_counts: Counter | None, vocab_size: int, special_tokens: list[str],
+                             monitor: TrainingMonitor | None = None,
+                             checkpoint_path: str | os.PathLike | None = None, checkpoint_every: int = 0,
+                             resume_from: str | os.PathLike | None = None,
+                             vocab: dict[int, bytes] | None = None, merges: list[tuple[bytes, bytes]] | None = None,
+                             merge_workers: int = 1):
+    """
+    Learn merges from a pretoken frequency table (pretoken bytes -> count).
+
+    The loop works on integer token ids: byte `b` is id `b` (as laid out by
+    `init_vocab`) and every merge gets the next free id. Bytes are only looked up
+    in `vocab` to break ties between equally frequent pairs and to report merges.
+    Pass a `TrainingMonitor` to get phase timings and periodic progress reports.
+
+    With `checkpoint_path`, the training state (see `save_bpe_state`) is written
+    there every `checkpoint_every` merges. `resume_from` continues from such a
+    snapshot instead of `pretoken_counts`, which may then be None; the result is
+    the same as an uninterrupted run.
+
+    Passing the `vocab` and `merges` of an earlier run grows that tokenizer to
+    `vocab_size` instead of starting from single bytes: its merges are replayed
+    over each distinct pretoken once (by rank, see `apply_merge_ranks`), and
+    learning continues from there. The existing merges and ids are kept as they are.
+
+    With `merge_workers > 1` the pretokens are split across that many processes
+    (see `MergeShards`) that apply each merge to their share in parallel; the
+    merges are the same as with a single process.
+    """
+    if resume_from is not None:
+        words, word_freqs, vocab, merge_ids = load_bpe_state(resume_from)
+    elif vocab is not None:
+        vocab = dict(vocab)
+        token_to_id = {token: token_id for token_id, token in vocab.items()}
+        for token in special_tokens:
+            token_bytes = token.encode("utf-8")
+            if token_bytes not in token_to_id:
+                token_to_id[token_bytes] = max(vocab) + 1
+                vocab[token_to_id[token_bytes]] = token_bytes
+
+        merge_ids = [(token_to_id[a], token_to_id[b]) for a, b in merges or []]
+        merge_ranks = build_merge_ranks(token_to_id, merges or [])
+        byte_ids = [token_to_id[bytes([b])] for b in range(256)]
+        words = [array("I", apply_merge_ranks([byte_ids[b] for b in pretoken], merge_ranks))
+                 for pretoken in pretoken_counts]
+        word_freqs = list(pretoken_counts.values())
+    else:
+        vocab = init_vocab(special_tokens)
+        # Distinct pretokens are addressed by id so the index below stays small;
+        # each one is a compact array of token ids, starting from its raw bytes
+        words = [array("I", list(pretoken)) for pretoken in pretoken_counts]
+        word_freqs = list(pretoken_counts.values())
+        merge_ids = []
 
-    pair_freqs = Counter()
-    for token, freq in tokens.items():
-        for a, b in zip(token, token[1:]):
-            pair_freqs[(a, b)] += freq
+    # merges - ordered from earliest-created to latest
+    merges = [(vocab[a], vocab[b]) for a, b in merge_ids]
 
 
-    # logger.info('pretokenization completed')
+    # logger.info(f"No of merges that are required to achieve vocab size {vocab_size} is {no_of_merges}")
 
-    # logger.info("Merging stared ...")
-    newtoken_id = max(vocab.keys()) + 1
+    no_of_merges = len(merges) + vocab_size - len(vocab)
+    if monitor is not None:
+        monitor.report(len(merges), no_of_merges, num_pretokens=len(words))
+        monitor.start_phase("count_pairs")
 
-    no_of_merges = vocab_size - len(vocab)
-    for i in range(no_of_merges):
+    # pair -> ids of the pretokens that contain it, so a merge only visits affected words
+    if merge_workers > 1:
+        shards = MergeShards(words, word_freqs, merge_workers)
+        pair_freqs = shards.pair_freqs
+    else:
+        shards = None
+        pair_freqs, pair_to_words = count_pairs(words, word_freqs)
 
-        if not pair_freqs:
-            break
-        
-        top_pair = max(pair_freqs.items(), key = lambda x: (x[1], x[0]))[0] # evaulate by count and pair. first count then pair to break a tie in case of 
-        # Add pair to the merges list
-        merges.append(top_pair)
 
-        # merge
-        p0 , p1 = top_pair
-        p0p1 = p0 + p1
-        # add that pair into new token and update the vocab 
-        vocab[newtoken_id] = p0p1
-        new_tokens = Counter()
+    pair_heap = PairHeap(pair_freqs, vocab)
 
-        pair_freqs_local = pair_freqs  # FIX 3: local cache
+    # logger.info('pretokenization completed')
 
-        # update tokens
-        for pretoken_tuple, freq in tokens.items():
-            new_token = []
-            i = 0
+    # logger.info("Merging stared ...")
+    newtoken_id = max(vocab.keys()) + 1
 
-            n = len(pretoken_tuple)
-            while i < n:
-                if i + 1 < n and (pretoken_tuple[i], pretoken_tuple[i+1]) == top_pair:
-                    has_left = len(new_token) > 0
-                    has_right = i + 2 < n
+    if monitor is not None:
+        monitor.report(len(merges), no_of_merges, len(pair_freqs), len(words))
+        monitor.start_phase("merge", len(merges))
 
-                    if has_left:
-                        left = new_token[-1]
-                        pair =(left, p0p1)
-                        pair_freqs_local[pair] += freq
+    # the shard workers hold a copy of the pretoken table; never leave them behind
+    try:
+        for i in range(len(merges), no_of_merges):
 
-                        old = (left, p0)
-                        pair_freqs_local[old] -= freq
-                        if pair_freqs_local[old] <= 0:
-                            del pair_freqs_local[old] 
+            # evaulate by count and pair. first count then pair to break a tie
+            top_pair = pair_heap.pop_max()
+            if top_pair is None:
+                break
 
+            # merge
+            p0 , p1 = top_pair
+            p0p1 = newtoken_id
 
-                    if has_right:
-                        right = pretoken_tuple[i+2]
-                        pair = (p0p1, right)
-                        pair_freqs_local[pair] += freq
+            # Add pair to the merges list and the new token to the vocab
+            merges.append((vocab[p0], vocab[p1]))
+            merge_ids.append(top_pair)
+            vocab[p0p1] = vocab[p0] + vocab[p1]
 
-                        old = (p1, right)
-                        pair_freqs_local[old] -= freq
-                        if pair_freqs_local[old] <= 0:
-                            del pair_freqs_local[old]
+            # update only the pretokens that contain the top pair
+            if shards is not None:
+                pair_deltas = shards.merge(top_pair, p0p1)
+            else:
+                pair_deltas = merge_words(pair_to_words.pop(top_pair), words, word_freqs, pair_to_words,
+                                          top_pair, p0p1)
 
+            for pair, delta in pair_deltas.items():
+                freq = pair_freqs.get(pair, 0) + delta
+                if freq > 0:
+                    pair_freqs[pair] = freq
+                else:
+                    pair_freqs.pop(pair, None)
 
-                    pair_freqs_local[top_pair] -= freq
-                    if pair_freqs_local[top_pair] <= 0:
-                        del pair_freqs_local[top_pair]
+            newtoken_id += 1
 
-                    new_token.append(p0p1)
-                    i+=2
+            # re-push every pair whose count moved; the old heap entries go stale
+            for pair in pair_deltas:
+                pair_heap.push(pair)
 
-                else:
-                    new_token.append(pretoken_tuple[i])
-                    i+=1
+            if monitor is not None and monitor.report_every and len(merges) % monitor.report_every == 0:
+                monitor.report(len(merges), no_of_merges, len(pair_freqs), len(words))
 
-            new_tokens[tuple(new_token)] += freq
+            if checkpoint_path is not None and checkpoint_every > 0 and len(merges) % checkpoint_every == 0:
+                if shards is not None:
+                    words = shards.gather_words()
+                save_bpe_state(checkpoint_path, words, word_freqs, vocab, merge_ids)
+    finally:
+        if shards is not None:
+            shards.close()
 
-        tokens = new_tokens
-        newtoken_id += 1
+    if monitor is not None:
+        monitor.report(len(merges), no_of_merges, len(pair_freqs), len(words))
+        monitor.start_phase("done")
 
     return vocab, merges
\ No newline at end of file
@@ -0,0 +1,149 @@
+"""
+Benchmark BPE training across corpus sizes, vocab sizes and worker counts.
+
+Every configuration runs in a fresh process so that peak RSS is measured per run,
+and pretokenization is timed separately from the merge loop. Results are appended
+to a JSON-lines file, one record per run:
+
+    python -m cs336_basics.bpe_benchmark --input data/TinyStoriesV2-GPT4-valid.txt \
+        --sizes 1M 4M 16M --vocab-sizes 1000 10000 --num-workers 1 4 --output bench.jsonl
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from . import bpe, bpe_zitong
+
+IMPLEMENTATIONS = ("bpe", "zitong")
+DEFAULT_INPUT = Path(__file__).resolve().parents[1] / "tests" / "fixtures" / "corpus.en"
+
+
+def _parse_size(size: str) -> int:
+    # "512K", "16M", "1G" or a plain byte count
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    if size[-1].upper() in units:
+        return int(float(size[:-1]) * units[size[-1].upper()])
+    return int(size)
+
+
+def write_prefix(input_path: Path, num_bytes: int, out_dir: Path, split_token: bytes) -> Path:
+    """
+    Copy roughly the first `num_bytes` of `input_path`, cut just before a special
+    token (or newline) so no document is truncated mid-way.
+    """
+    with open(input_path, "rb") as f:
+        data = f.read(num_bytes)
+    if len(data) == num_bytes:
+        cut = data.rfind(split_token)
+        if cut <= 0:
+            cut = data.rfind(b"\n")
+        if cut > 0:
+            data = data[:cut]
+    out_path = out_dir / f"{input_path.stem}_{len(data)}{input_path.suffix}"
+    out_path.write_bytes(data)
+    return out_path
+
+
+def run_one(implementation: str, input_path: str, vocab_size: int, special_tokens: list[str],
+            num_workers: int) -> dict:
+    """Train once and report per-phase timings; meant to run in its own process."""
+    started = time.perf_counter()
+    if implementation == "bpe":
+        if num_workers > 1:
+            pretoken_counts = bpe.pretokenize_parallel(input_path, special_tokens, num_workers)
+        else:
+            pretoken_counts = bpe.count_pretokens_from_file(input_path, special_tokens)
+        pretokenize_seconds = time.perf_counter() - started
+        vocab, merges = bpe.train_bpe_from_pretokens(pretoken_counts, vocab_size, special_tokens)
+        total_seconds = time.perf_counter() - started
+        num_pretokens = len(pretoken_counts)
+    elif implementation == "zitong":
+        # bpe_zitong.train_bpe pretokenizes internally, so time that phase on its own
+        # first and count the rest of a full run as the merge loop
+        pretoken_freq = bpe_zitong._read_text_file(input_path, num_workers, special_tokens)
+        pretokenize_seconds = time.perf_counter() - started
+        num_pretokens = len(pretoken_freq)
+        started = time.perf_counter()
+        vocab, merges = bpe_zitong.train_bpe(input_path, vocab_size, special_tokens, num_workers=num_workers)
+        total_seconds = time.perf_counter() - started
+    else:
+        raise ValueError(f"Unknown implementation {implementation!r}, expected one of {IMPLEMENTATIONS}")
+
+    return {
+        "implementation": implementation,
+        "corpus_bytes": os.path.getsize(input_path),
+        "vocab_size": vocab_size,
+        "num_workers": num_workers,
+        "num_pretokens": num_pretokens,
+        "num_merges": len(merges),
+        "pretokenize_seconds": pretokenize_seconds,
+        "merge_seconds": total_seconds - pretokenize_seconds,
+        "total_seconds": total_seconds,
+        # count pool workers too
+        "peak_rss_bytes": bpe.peak_rss_bytes(include_children=True),
+    }
+
+
+def _run_in_subprocess(queue, *args) -> None:
+    try:
+        queue.put(run_one(*args))
+    except Exception as e:
+        queue.put({"error": repr(e)})
+
+
+def run_isolated(*args) -> dict:
+    # A spawned interpreter starts with a clean RSS high-water mark
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_run_in_subprocess, args=(queue, *args))
+    process.start()
+    result = queue.get()
+    process.join()
+    if "error" in result:
+        raise RuntimeError(f"benchmark run {args} failed: {result['error']}")
+    return result
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--input", type=Path, default=DEFAULT_INPUT)
+    parser.add_argument("--sizes", nargs="+", default=["full"],
+                        help="corpus prefix sizes such as 1M or 512K, or 'full'")
+    parser.add_argument("--vocab-sizes", nargs="+", type=int, default=[500])
+    parser.add_argument("--num-workers", nargs="+", type=int, default=[1])
+    parser.add_argument("--implementations", nargs="+", choices=IMPLEMENTATIONS, default=list(IMPLEMENTATIONS))
+    parser.add_argument("--special-tokens", nargs="*", default=["<|endoftext|>"])
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument("--output", type=Path, default=Path("bpe_benchmark.jsonl"))
+    args = parser.parse_args(argv)
+
+    split_token = args.special_tokens[0].encode("utf-8") if args.special_tokens else b"\n"
+    with tempfile.TemporaryDirectory() as tmp_dir, open(args.output, "a") as out:
+        inputs = [
+            args.input if size == "full" else write_prefix(args.input, _parse_size(size), Path(tmp_dir), split_token)
+            for size in args.sizes
+        ]
+        for input_path in inputs:
+            for vocab_size in args.vocab_sizes:
+                for num_workers in args.num_workers:
+                    for implementation in args.implementations:
+                        for repeat in range(args.repeats):
+                            result = run_isolated(implementation, str(input_path), vocab_size,
+                                                  args.special_tokens, num_workers)
+                            result["repeat"] = repeat
+                            out.write(json.dumps(result) + "\n")
+                            out.flush()
+                            print(
+                                f"{implementation:>7} bytes={result['corpus_bytes']:>11,} vocab={vocab_size:>6} "
+                                f"workers={num_workers:>2} pretokenize={result['pretokenize_seconds']:7.2f}s "
+                                f"merge={result['merge_seconds']:7.2f}s "
+                                f"rss={result['peak_rss_bytes'] / 2**20:8.1f}MiB"
+                            )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ from typing import Iterable
 from tqdm import tqdm
 import logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-from collections import Counter
+from collections import Counter, defaultdict
 import concurrent.futures
 
 
@@ -81,14 +81,21 @@ def train_bpe(input_path: str, vocab_size: int, special_tokens: Iterable[str],
     
     pretoken_freq = _read_text_file(input_path, num_workers, special_tokens)
 
+    # Address pretokens by index so that merges only revisit the ones they touch
+    pretokens = list(pretoken_freq.keys())
+    pretoken_counts = list(pretoken_freq.values())
+
     logging.info("Initializing byte pair frequency table")
     pair_freq = Counter()
-    for pretoken_tuple, freq in tqdm(pretoken_freq.items(), disable=not progress_bar):
+    pair_to_pretokens = defaultdict(set)
+    for idx, (pretoken_tuple, freq) in enumerate(tqdm(zip(pretokens, pretoken_counts),
+                                                     total=len(pretokens), disable=not progress_bar)):
         for i in range(len(pretoken_tuple) - 1):
             pair = pretoken_tuple[i:i+2]
             if pair not in pair_freq:
                 pair_freq[pair] = 0
             pair_freq[pair] += freq
+            pair_to_pretokens[pair].add(idx)
 
     logging.info("Performing BPE algorithm")
     pre_merge_vocab_size = len(vocab)
@@ -105,9 +112,11 @@ def train_bpe(input_path: str, vocab_size: int, special_tokens: Iterable[str],
         new_id = max(vocab.keys()) + 1
         vocab[new_id] = b"".join(most_freq_pair)
 
-        # Update the pre-token frequency table and pair frequency table
-        new_pretoken_freq = {}
-        for pretoken_tuple, freq in pretoken_freq.items():
+        # Update the affected pre-tokens and the pair frequency table
+        for idx in pair_to_pretokens.pop(most_freq_pair, ()):
+            pretoken_tuple = pretokens[idx]
+            freq = pretoken_counts[idx]
+            old_pairs = {pretoken_tuple[i:i+2] for i in range(len(pretoken_tuple) - 1)}
             i=0
             while i < len(pretoken_tuple):
                 pair = pretoken_tuple[i:i+2]
@@ -127,9 +136,14 @@ def train_bpe(input_path: str, vocab_size: int, special_tokens: Iterable[str],
                         pair_freq[del_pair] -= freq
                     pair_freq[most_freq_pair] -= freq
                 i+=1
-            # Update the pre-token frequency table
-            new_pretoken_freq[pretoken_tuple] = freq
-        pretoken_freq = new_pretoken_freq
+            # Update the pre-token table and the pair index
+            pretokens[idx] = pretoken_tuple
+            new_pairs = {pretoken_tuple[i:i+2] for i in range(len(pretoken_tuple) - 1)}
+            for pair in old_pairs - new_pairs:
+                if pair != most_freq_pair:
+                    pair_to_pretokens[pair].discard(idx)
+            for pair in new_pairs - old_pairs:
+                pair_to_pretokens[pair].add(idx)
         pbar.update(len(vocab) - pre_merge_vocab_size - pbar.n) if progress_bar else None
     pbar.close() if progress_bar else None
 
@@ -0,0 +1,321 @@
+import logging
+import os
+import queue
+import struct
+import tempfile
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import repeat
+
+import numpy as np
+import torch
+
+from .bpe import DEFAULT_CHUNK_SIZE, decode_range, file_chunk_boundaries, map_file, open_mapping
+from .tokenizer import DEFAULT_BUFFER_SIZE, Tokenizer
+
+logger = logging.getLogger(__name__)
+
+# Token files are a fixed header followed by the raw token ids:
+# magic, dtype string (e.g. b"<u2"), vocab size, number of tokens
+TOKEN_FILE_MAGIC = b"BPETOKS1"
+TOKEN_FILE_HEADER = struct.Struct("<8s8sQQ")
+
+
+def token_dtype(vocab_size: int) -> np.dtype:
+    # Smallest unsigned dtype that can hold every token id
+    return np.dtype(np.uint16) if vocab_size <= 1 << 16 else np.dtype(np.uint32)
+
+
+class TokenFileWriter:
+    """
+    Append token ids to a memory-mapped token file that grows as needed.
+
+    The mapping doubles in size whenever it fills up and is truncated to the
+    tokens actually written on `close`, when the header gets the final count.
+    """
+
+    def __init__(self, path: str | os.PathLike, vocab_size: int, dtype: np.dtype | None = None,
+                 initial_capacity: int = 1 << 20):
+        self.path = path
+        self.vocab_size = vocab_size
+        self.dtype = np.dtype(dtype) if dtype is not None else token_dtype(vocab_size)
+        if self.dtype.kind != "u" or np.iinfo(self.dtype).max < vocab_size - 1:
+            raise ValueError(f"dtype {self.dtype} cannot hold token ids of a vocab of size {vocab_size}")
+
+        self.num_tokens = 0
+        self.file = open(path, "w+b")
+        self._write_header()
+        self._map(max(1, initial_capacity))
+
+    def _write_header(self) -> None:
+        self.file.seek(0)
+        self.file.write(TOKEN_FILE_HEADER.pack(TOKEN_FILE_MAGIC, self.dtype.str.encode("ascii"),
+                                               self.vocab_size, self.num_tokens))
+
+    def _map(self, capacity: int) -> None:
+        self.capacity = capacity
+        self.file.truncate(TOKEN_FILE_HEADER.size + capacity * self.dtype.itemsize)
+        self.tokens = np.memmap(self.file, dtype=self.dtype, mode="r+",
+                                offset=TOKEN_FILE_HEADER.size, shape=(capacity,))
+
+    def write(self, ids: Iterable[int] | np.ndarray) -> None:
+        ids = np.asarray(ids, dtype=self.dtype)
+        end = self.num_tokens + ids.size
+        if end > self.capacity:
+            self.tokens.flush()
+            del self.tokens
+            self._map(max(end, 2 * self.capacity))
+        self.tokens[self.num_tokens:end] = ids
+        self.num_tokens = end
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.tokens.flush()
+        del self.tokens
+        self.file.truncate(TOKEN_FILE_HEADER.size + self.num_tokens * self.dtype.itemsize)
+        self._write_header()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load_token_file(path: str | os.PathLike, mode: str = "r") -> np.memmap:
+    """
+    Memory-map the token ids of a file written by `TokenFileWriter`.
+
+    The vocab size from the header is available as the `vocab_size` attribute
+    of the returned array.
+    """
+    with open(path, "rb") as f:
+        magic, dtype, vocab_size, num_tokens = TOKEN_FILE_HEADER.unpack(f.read(TOKEN_FILE_HEADER.size))
+    if magic != TOKEN_FILE_MAGIC:
+        raise ValueError(f"{path} is not a token file")
+
+    dtype = np.dtype(dtype.rstrip(b"\0").decode("ascii"))
+    if num_tokens == 0:
+        tokens = np.zeros(0, dtype=dtype).view(np.memmap)
+    else:
+        tokens = np.memmap(path, dtype=dtype, mode=mode, offset=TOKEN_FILE_HEADER.size, shape=(num_tokens,))
+    tokens.vocab_size = vocab_size
+    return tokens
+
+
+def encode_to_token_file(tokenizer: Tokenizer, iterable: Iterable[str], out_path: str | os.PathLike,
+                         dtype: np.dtype | None = None, buffer_size: int = DEFAULT_BUFFER_SIZE) -> int:
+    """
+    Stream `iterable` (lines, text chunks or a text file handle) through `tokenizer`
+    straight into a token file, holding about `buffer_size` characters at a time.
+    Returns the number of tokens written.
+    """
+    vocab_size = max(tokenizer.vocab) + 1
+    with TokenFileWriter(out_path, vocab_size, dtype) as writer:
+        for ids in tokenizer.encode_chunks(iterable, buffer_size):
+            writer.write(ids)
+    return writer.num_tokens
+
+
+@dataclass
+class EncodeStats:
+    num_tokens: int
+    num_bytes: int
+    seconds: float
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.num_tokens / self.seconds if self.seconds > 0 else float("inf")
+
+    @property
+    def bytes_per_token(self) -> float:
+        return self.num_bytes / self.num_tokens if self.num_tokens else 0.0
+
+
+# Each encode worker builds its tokenizer and maps the corpus once, in the pool initializer
+_worker_tokenizer = None
+_worker_mapped = None
+
+
+def _init_encode_worker(input_path: str | os.PathLike, vocab: dict[int, bytes],
+                        merges: list[tuple[bytes, bytes]], special_tokens: list[str] | None) -> None:
+    global _worker_tokenizer, _worker_mapped
+    _worker_tokenizer = Tokenizer(vocab, merges, special_tokens)
+    _worker_mapped = open_mapping(input_path)
+
+
+def _encode_shard(start: int, end: int, shard_path: str, dtype: np.dtype) -> int:
+    # Encode one byte range of the corpus into a raw shard; only the token count goes back to the parent
+    ids = np.asarray(_worker_tokenizer.encode(decode_range(_worker_mapped, start, end)), dtype=dtype)
+    ids.tofile(shard_path)
+    return ids.size
+
+
+def tokenizer_vocab_size(vocab: dict[int, bytes], special_tokens: list[str]) -> int:
+    # Ids a `Tokenizer` can emit: special tokens missing from `vocab` are appended after it
+    missing = {token.encode("utf-8") for token in special_tokens} - set(vocab.values())
+    return max(vocab) + 1 + len(missing)
+
+
+def encode_file_parallel(input_path: str | os.PathLike, out_path: str | os.PathLike,
+                         vocab: dict[int, bytes], merges: list[tuple[bytes, bytes]],
+                         special_tokens: list[str] | None = None, num_workers: int = 1,
+                         chunk_size: int = DEFAULT_CHUNK_SIZE) -> EncodeStats:
+    """
+    Encode the corpus at `input_path` into a token file at `out_path` using a process pool.
+
+    The file is cut before special tokens (see `file_chunk_boundaries`) into
+    pieces of about `chunk_size` bytes. Workers encode pieces into temporary
+    shards next to `out_path`, which are then concatenated in file order, so the
+    result equals encoding the whole file at once. With a single worker the pieces
+    are encoded in this process, straight into the token file.
+    """
+    special_tokens = special_tokens or []
+    vocab_size = tokenizer_vocab_size(vocab, special_tokens)
+    dtype = token_dtype(vocab_size)
+
+    started = time.perf_counter()
+    num_bytes = os.path.getsize(input_path)
+    num_chunks = max(num_workers, num_bytes // chunk_size)
+    boundaries = file_chunk_boundaries(input_path, special_tokens, num_chunks)
+
+    if num_workers > 1:
+        with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_path))) as shard_dir:
+            shard_paths = [os.path.join(shard_dir, f"{i:06d}.bin") for i in range(len(boundaries) - 1)]
+            with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_encode_worker,
+                                     initargs=(input_path, vocab, merges, special_tokens)) as exe:
+                shard_sizes = list(exe.map(_encode_shard, boundaries[:-1], boundaries[1:], shard_paths,
+                                           repeat(dtype)))
+
+            with TokenFileWriter(out_path, vocab_size, dtype, initial_capacity=sum(shard_sizes)) as writer:
+                for shard_path in shard_paths:
+                    writer.write(np.fromfile(shard_path, dtype=dtype))
+                    os.remove(shard_path)
+    else:
+        tokenizer = Tokenizer(vocab, merges, special_tokens)
+        with map_file(input_path) as mapped, TokenFileWriter(out_path, vocab_size, dtype) as writer:
+            for start, end in zip(boundaries[:-1], boundaries[1:]):
+                writer.write(tokenizer.encode(decode_range(mapped, start, end)))
+
+    stats = EncodeStats(writer.num_tokens, num_bytes, time.perf_counter() - started)
+    logger.info(
+        f"Encoded {stats.num_bytes} bytes into {stats.num_tokens} tokens in {stats.seconds:.1f}s "
+        f"({stats.tokens_per_sec:,.0f} tokens/sec, {stats.bytes_per_token:.2f} bytes/token)"
+    )
+    return stats
+
+
+def sample_windows(dataset: np.ndarray, batch_size: int, context_length: int, rng: np.random.Generator,
+                   pin_memory: bool = False) -> torch.Tensor:
+    # (batch_size, context_length + 1) int64 windows of `dataset`, gathered with one fancy index
+    starts = rng.integers(0, len(dataset) - context_length, size=batch_size)
+    windows = np.asarray(dataset[starts[:, None] + np.arange(context_length + 1)], dtype=np.int64)
+    batch = torch.from_numpy(windows)
+    return batch.pin_memory() if pin_memory else batch
+
+
+def _split_batch(batch: torch.Tensor, device: torch.device, pin_memory: bool) -> tuple[torch.Tensor, torch.Tensor]:
+    batch = batch.to(device, non_blocking=pin_memory)
+    return batch[:, :-1], batch[:, 1:]
+
+
+def get_batch(dataset: np.ndarray, batch_size: int, context_length: int, device: str | torch.device,
+              rng: np.random.Generator | None = None,
+              pin_memory: bool | None = None) -> tuple[torch.Tensor, torch.Tensor]:
+    """
+    Sample `batch_size` random windows of `dataset` as inputs and next-token labels.
+
+    `dataset` can be a memory-mapped token file (see `load_token_file`): all
+    windows are gathered with one fancy index of `context_length + 1` tokens each,
+    so only the touched pages are read, and x and y are the two overlapping views
+    of that single gather. The batch is copied to `device` from pinned memory
+    without blocking when `pin_memory` is set, which is the default for CUDA.
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    device = torch.device(device)
+    if pin_memory is None:
+        pin_memory = device.type == "cuda"
+    return _split_batch(sample_windows(dataset, batch_size, context_length, rng, pin_memory), device, pin_memory)
+
+
+class BatchPrefetcher:
+    """
+    Iterate over training batches (x, y) that a background thread samples ahead of time.
+
+    The batch of step `s` is drawn with `np.random.default_rng([seed, s])`, so it
+    only depends on the seed and the step: a run restarted with
+    `start_step=prefetcher.step` sees exactly the batches it would have seen.
+    Up to `prefetch` batches wait in a bounded queue, already pinned for CUDA;
+    only the copy to `device` happens on the consuming thread. Iteration stops
+    after step `num_steps - 1`, or never if `num_steps` is None.
+    """
+
+    def __init__(self, dataset: np.ndarray, batch_size: int, context_length: int, device: str | torch.device,
+                 seed: int = 0, start_step: int = 0, num_steps: int | None = None, prefetch: int = 4,
+                 pin_memory: bool | None = None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.context_length = context_length
+        self.device = torch.device(device)
+        self.pin_memory = self.device.type == "cuda" if pin_memory is None else pin_memory
+        self.seed = seed
+        self.step = start_step
+        self.num_steps = num_steps
+
+        self.queue = queue.Queue(maxsize=max(1, prefetch))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._produce, args=(start_step,), daemon=True)
+        self.thread.start()
+
+    def _produce(self, step: int) -> None:
+        try:
+            while not self.stopped.is_set() and (self.num_steps is None or step < self.num_steps):
+                rng = np.random.default_rng([self.seed, step])
+                batch = sample_windows(self.dataset, self.batch_size, self.context_length, rng, self.pin_memory)
+                self._put((step, batch))
+                step += 1
+            self._put(None)
+        except BaseException as e:
+            self._put(e)
+
+    def _put(self, item) -> None:
+        # Give up once the consumer has closed us instead of blocking on a full queue forever
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> tuple[torch.Tensor, torch.Tensor]:
+        if self.stopped.is_set():
+            raise StopIteration
+        item = self.queue.get()
+        if item is None:
+            self.close()
+            raise StopIteration
+        if isinstance(item, BaseException):
+            self.close()
+            raise item
+
+        step, batch = item
+        self.step = step + 1
+        return _split_batch(batch, self.device, self.pin_memory)
+
+    def close(self) -> None:
+        self.stopped.set()
+        self.thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,292 @@
+import math
+from functools import lru_cache
+
+import torch
+from torch import Tensor, nn
+
+
+def init_linear_weight_(weight: Tensor) -> Tensor:
+    # N(0, 2 / (d_in + d_out)) truncated at three standard deviations
+    d_out, d_in = weight.shape
+    std = math.sqrt(2 / (d_in + d_out))
+    return nn.init.trunc_normal_(weight, mean=0.0, std=std, a=-3 * std, b=3 * std)
+
+
+class Linear(nn.Module):
+    """Bias-free linear layer; `weight` is stored as (out_features, in_features)."""
+
+    def __init__(self, in_features: int, out_features: int, device: torch.device | None = None,
+                 dtype: torch.dtype | None = None):
+        super().__init__()
+        self.weight = nn.Parameter(torch.empty(out_features, in_features, device=device, dtype=dtype))
+        init_linear_weight_(self.weight)
+
+    def forward(self, x: Tensor) -> Tensor:
+        return x @ self.weight.T
+
+
+@lru_cache(maxsize=32)
+def rope_tables(d_k: int, theta: float, max_seq_len: int, dtype: torch.dtype,
+                device: torch.device) -> tuple[Tensor, Tensor]:
+    """
+    (max_seq_len, d_k // 2) cos and sin of the RoPE angles `i / theta^(2k / d_k)`.
+
+    Tables are built once per configuration and shared by every caller in the
+    process, so all attention layers of a model point at the same two tensors.
+    Angles are computed in float64 before casting to `dtype`.
+    """
+    if d_k % 2:
+        raise ValueError(f"RoPE needs an even d_k, got {d_k}")
+    inv_freq = theta ** -(torch.arange(0, d_k, 2, dtype=torch.float64, device=device) / d_k)
+    angles = torch.arange(max_seq_len, dtype=torch.float64, device=device)[:, None] * inv_freq
+    return angles.cos().to(dtype), angles.sin().to(dtype)
+
+
+class RotaryPositionalEmbedding(nn.Module):
+    """
+    Rotate each (even, odd) pair of features of a query or key by its position's angle.
+
+    The cos/sin tables come from `rope_tables` and are gathered by
+    `token_positions`, so positions need not be contiguous or start at 0. The
+    pairs are read as strided views of the input and written straight into the
+    output, without stacking or interleaving intermediate tensors.
+    """
+
+    def __init__(self, theta: float, d_k: int, max_seq_len: int, device: torch.device | None = None,
+                 dtype: torch.dtype | None = None):
+        super().__init__()
+        self.theta = theta
+        self.d_k = d_k
+        self.max_seq_len = max_seq_len
+        dtype = dtype or torch.get_default_dtype()
+        cos, sin = rope_tables(d_k, theta, max_seq_len, dtype, torch.device(device or "cpu"))
+        # derived from the config, so not worth saving in checkpoints
+        self.register_buffer("cos", cos, persistent=False)
+        self.register_buffer("sin", sin, persistent=False)
+
+    def forward(self, x: Tensor, token_positions: Tensor | None = None) -> Tensor:
+        if token_positions is None:
+            token_positions = torch.arange(x.shape[-2], device=x.device)
+        cos = self.cos[token_positions].to(x.dtype)
+        sin = self.sin[token_positions].to(x.dtype)
+
+        x_even, x_odd = x[..., 0::2], x[..., 1::2]
+        out = torch.empty(torch.broadcast_shapes(x.shape, (*cos.shape[:-1], x.shape[-1])),
+                          dtype=x.dtype, device=x.device)
+        out[..., 0::2] = torch.addcmul(x_even * cos, x_odd, sin, value=-1)
+        out[..., 1::2] = torch.addcmul(x_odd * cos, x_even, sin)
+        return out
+
+
+def softmax(x: Tensor, dim: int) -> Tensor:
+    # Subtracting the max keeps exp from overflowing; it cancels out in the ratio
+    exp = torch.exp(x - x.amax(dim=dim, keepdim=True))
+    return exp / exp.sum(dim=dim, keepdim=True)
+
+
+def scaled_dot_product_attention(Q: Tensor, K: Tensor, V: Tensor, mask: Tensor | None = None) -> Tensor:
+    """
+    softmax(Q K^T / sqrt(d_k)) V over the last two dimensions, where `mask` is a
+    boolean (..., queries, keys) tensor that is True where a query may attend.
+    """
+    scores = Q @ K.transpose(-2, -1) / math.sqrt(Q.shape[-1])
+    if mask is not None:
+        scores = scores.masked_fill(~mask, float("-inf"))
+    return softmax(scores, dim=-1) @ V
+
+
+def _tile_scores(q: Tensor, K: Tensor, mask: Tensor | None, is_causal: bool, q_start: int, q_end: int,
+                 k_start: int, k_end: int) -> Tensor:
+    # (already scaled) scores of one tile, with -inf where the query may not attend
+    scores = q @ K[..., k_start:k_end, :].transpose(-2, -1)
+    if mask is not None:
+        scores = scores.masked_fill(~mask[..., q_start:q_end, k_start:k_end], float("-inf"))
+    if is_causal and k_end > q_start + 1:
+        future = (torch.arange(q_start, q_end, device=q.device)[:, None]
+                  < torch.arange(k_start, k_end, device=q.device))
+        scores = scores.masked_fill(future, float("-inf"))
+    return scores
+
+
+class _TiledAttention(torch.autograd.Function):
+    """
+    Tiled attention whose backward pass recomputes the tiles instead of keeping them.
+
+    The forward pass saves only the inputs, the output and the log-sum-exp of each
+    row of scores; backward rebuilds each tile's softmax weights from those, so
+    training needs memory linear in the sequence length too.
+    """
+
+    @staticmethod
+    def forward(ctx, Q: Tensor, K: Tensor, V: Tensor, mask: Tensor | None, is_causal: bool,
+                block_size: int) -> Tensor:
+        num_queries, num_keys = Q.shape[-2], K.shape[-2]
+        out_dtype = torch.promote_types(Q.dtype, V.dtype)
+        compute_dtype = torch.promote_types(out_dtype, torch.float32)
+        q_all = Q.to(compute_dtype) / math.sqrt(Q.shape[-1])
+        k_all, v_all = K.to(compute_dtype), V.to(compute_dtype)
+
+        out_blocks, lse_blocks = [], []
+        for q_start in range(0, num_queries, block_size):
+            q_end = min(q_start + block_size, num_queries)
+            q = q_all[..., q_start:q_end, :]
+            k_stop = min(num_keys, q_end) if is_causal else num_keys
+
+            running_max = total = acc = None
+            for k_start in range(0, k_stop, block_size):
+                k_end = min(k_start + block_size, k_stop)
+                scores = _tile_scores(q, k_all, mask, is_causal, q_start, q_end, k_start, k_end)
+
+                block_max = scores.amax(dim=-1, keepdim=True)
+                new_max = block_max if running_max is None else torch.maximum(running_max, block_max)
+                # rows that have seen nothing but masked keys so far keep zero weights, not NaNs
+                safe_max = new_max.masked_fill(new_max == float("-inf"), 0.0)
+                weights = torch.exp(scores - safe_max)
+                block_total = weights.sum(dim=-1, keepdim=True)
+                block_out = weights @ v_all[..., k_start:k_end, :]
+
+                if acc is None:
+                    total, acc = block_total, block_out
+                else:
+                    correction = torch.exp(running_max - safe_max)
+                    total = total * correction + block_total
+                    acc = acc * correction + block_out
+                running_max = new_max
+
+            # a fully masked row ends as 0 / 0 = NaN, as with the dense softmax
+            out_blocks.append(acc / total)
+            # and its log-sum-exp as -inf
+            lse_blocks.append(running_max + total.log())
+
+        out = torch.cat(out_blocks, dim=-2).to(out_dtype)
+        ctx.save_for_backward(Q, K, V, mask, out, torch.cat(lse_blocks, dim=-2))
+        ctx.is_causal, ctx.block_size = is_causal, block_size
+        return out
+
+    @staticmethod
+    @torch.autograd.function.once_differentiable
+    def backward(ctx, grad_out: Tensor):
+        Q, K, V, mask, out, lse = ctx.saved_tensors
+        is_causal, block_size = ctx.is_causal, ctx.block_size
+        num_queries, num_keys = Q.shape[-2], K.shape[-2]
+        compute_dtype = lse.dtype
+        scale = 1 / math.sqrt(Q.shape[-1])
+        q_all = Q.to(compute_dtype) * scale
+        k_all, v_all = K.to(compute_dtype), V.to(compute_dtype)
+        grad_out = grad_out.to(compute_dtype)
+
+        # fully masked rows attend to nothing, so they pass no gradient back
+        masked_rows = lse == float("-inf")
+        lse = lse.masked_fill(masked_rows, 0.0)
+        # rowsum(dO * O), the softmax term shared by every tile of a row
+        row_dot = (grad_out * out.to(compute_dtype)).sum(dim=-1, keepdim=True).masked_fill(masked_rows, 0.0)
+
+        batch_shape = out.shape[:-2]
+        grad_q = torch.zeros(*batch_shape, *Q.shape[-2:], dtype=compute_dtype, device=Q.device)
+        grad_k = torch.zeros(*batch_shape, *K.shape[-2:], dtype=compute_dtype, device=K.device)
+        grad_v = torch.zeros(*batch_shape, *V.shape[-2:], dtype=compute_dtype, device=V.device)
+        for q_start in range(0, num_queries, block_size):
+            q_end = min(q_start + block_size, num_queries)
+            rows = slice(q_start, q_end)
+            q, d_out = q_all[..., rows, :], grad_out[..., rows, :]
+            k_stop = min(num_keys, q_end) if is_causal else num_keys
+
+            for k_start in range(0, k_stop, block_size):
+                k_end = min(k_start + block_size, k_stop)
+                cols = slice(k_start, k_end)
+                scores = _tile_scores(q, k_all, mask, is_causal, q_start, q_end, k_start, k_end)
+                weights = torch.exp(scores - lse[..., rows, :])
+
+                grad_v[..., cols, :] += weights.transpose(-2, -1) @ d_out
+                grad_scores = weights * (d_out @ v_all[..., cols, :].transpose(-2, -1) - row_dot[..., rows, :])
+                grad_q[..., rows, :] += grad_scores @ k_all[..., cols, :]
+                grad_k[..., cols, :] += grad_scores.transpose(-2, -1) @ q
+
+        # summed back over any dimensions the inputs were broadcast along
+        grad_q = (grad_q * scale).sum_to_size(Q.shape).to(Q.dtype)
+        grad_k = grad_k.sum_to_size(K.shape).to(K.dtype)
+        grad_v = grad_v.sum_to_size(V.shape).to(V.dtype)
+        return grad_q, grad_k, grad_v, None, None, None
+
+
+def tiled_scaled_dot_product_attention(Q: Tensor, K: Tensor, V: Tensor, mask: Tensor | None = None,
+                                       is_causal: bool = False, block_size: int = 256) -> Tensor:
+    """
+    Same result as `scaled_dot_product_attention`, computed one
+    (`block_size` queries, `block_size` keys) tile at a time.
+
+    Each query block keeps a running max, softmax denominator and weighted sum of
+    values, rescaled whenever a later key block raises the max (online softmax),
+    so the full queries x keys score matrix is never built. The backward pass
+    recomputes the tiles from the output and each row's log-sum-exp, so both
+    passes need memory linear in the sequence length. With `is_causal`, query i
+    attends keys 0..i: key blocks entirely in the future are skipped and only
+    tiles on the diagonal get a (tile-sized) mask. `mask` is sliced per tile and
+    may be combined with `is_causal`. Scores are accumulated in at least float32.
+    Fully masked rows come out as NaN, as with the dense version, but pass back
+    zero gradients.
+    """
+    return _TiledAttention.apply(Q, K, V, mask, is_causal, block_size)
+
+
+class MultiHeadSelfAttention(nn.Module):
+    """
+    Causal multi-head self-attention with a fused QKV projection.
+
+    `qkv_proj.weight` is the (3 * d_model, d_model) concatenation of the query,
+    key and value weights, so all heads of all three projections come out of one
+    matrix multiply. The heads are then split by reshaping and transposing views
+    of that output, without copying it.
+
+    State dicts with separate `q_proj.weight`, `k_proj.weight` and `v_proj.weight`
+    (the layout of the reference checkpoints, e.g. `attn.q_proj.weight` in a
+    transformer block) are fused on load.
+
+    With `theta` and `max_seq_len`, queries and keys of every head are rotated by
+    RoPE at `token_positions` (0..seq_len-1 by default).
+    """
+
+    def __init__(self, d_model: int, num_heads: int, max_seq_len: int | None = None, theta: float | None = None,
+                 device: torch.device | None = None, dtype: torch.dtype | None = None):
+        super().__init__()
+        if d_model % num_heads:
+            raise ValueError(f"d_model={d_model} is not divisible by num_heads={num_heads}")
+        self.d_model = d_model
+        self.num_heads = num_heads
+        self.d_head = d_model // num_heads
+
+        self.qkv_proj = Linear(d_model, 3 * d_model, device=device, dtype=dtype)
+        self.output_proj = Linear(d_model, d_model, device=device, dtype=dtype)
+        # initialise like three separate (d_model, d_model) projections
+        with torch.no_grad():
+            for weight in self.qkv_proj.weight.chunk(3):
+                init_linear_weight_(weight)
+
+        if theta is not None:
+            self.rope = RotaryPositionalEmbedding(theta, self.d_head, max_seq_len, device=device, dtype=dtype)
+        else:
+            self.rope = None
+
+        self.register_load_state_dict_pre_hook(self._fuse_qkv_weights)
+
+    @staticmethod
+    def _fuse_qkv_weights(module, state_dict, prefix, *args) -> None:
+        keys = [f"{prefix}{name}_proj.weight" for name in ("q", "k", "v")]
+        if all(key in state_dict for key in keys):
+            state_dict[f"{prefix}qkv_proj.weight"] = torch.cat([state_dict.pop(key) for key in keys])
+
+    def forward(self, x: Tensor, token_positions: Tensor | None = None) -> Tensor:
+        # (..., seq, 3 * d_model) -> three (..., heads, seq, d_head) views
+        qkv = self.qkv_proj(x).unflatten(-1, (3, self.num_heads, self.d_head))
+        q, k, v = qkv.movedim(-4, -2).unbind(-4)
+
+        if self.rope is not None:
+            if token_positions is not None:
+                # the same positions for every head
+                token_positions = token_positions.unsqueeze(-2)
+            q = self.rope(q, token_positions)
+            k = self.rope(k, token_positions)
+
+        out = tiled_scaled_dot_product_attention(q, k, v, is_causal=True)
+        # back to (..., seq, d_model); the only copy is this merge of the heads
+        return self.output_proj(out.movedim(-3, -2).flatten(-2))
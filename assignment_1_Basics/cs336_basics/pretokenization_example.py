@@ -1,3 +1,4 @@
+import mmap
 import os
 from typing import BinaryIO
 
@@ -49,14 +50,42 @@ def find_chunk_boundaries(
     return sorted(set(chunk_boundaries))
 
 
+def find_chunk_boundaries_mmap(
+    mapped: mmap.mmap,
+    desired_num_chunks: int,
+    split_special_token: bytes,
+) -> list[int]:
+    """
+    Same boundaries as `find_chunk_boundaries`, but searched with `mmap.find`
+    directly in a mapping of the file, so no mini-chunks are read or copied.
+    """
+    assert isinstance(split_special_token, bytes), "Must represent special token as a bytestring"
+
+    file_size = len(mapped)
+    chunk_size = file_size // desired_num_chunks
+
+    chunk_boundaries = [i * chunk_size for i in range(desired_num_chunks + 1)]
+    chunk_boundaries[-1] = file_size
+
+    for bi in range(1, len(chunk_boundaries) - 1):
+        # Snap each guess forward to the next special token, or to the end of the file
+        found_at = mapped.find(split_special_token, chunk_boundaries[bi])
+        chunk_boundaries[bi] = found_at if found_at != -1 else file_size
+
+    return sorted(set(chunk_boundaries))
+
+
 ## Usage
-with open(..., "rb") as f:
-    num_processes = 4
-    boundaries = find_chunk_boundaries(f, num_processes, b"<|endoftext|>")
-
-    # The following is a serial implementation, but you can parallelize this
-    # by sending each start/end pair to a set of processes.
-    for start, end in zip(boundaries[:-1], boundaries[1:]):
-        f.seek(start)
-        chunk = f.read(end - start).decode("utf-8", errors="ignore")
-        # Run pre-tokenization on your chunk and store the counts for each pre-token
+if __name__ == "__main__":
+    import sys
+
+    with open(sys.argv[1], "rb") as f:
+        num_processes = 4
+        boundaries = find_chunk_boundaries(f, num_processes, b"<|endoftext|>")
+
+        # The following is a serial implementation, but you can parallelize this
+        # by sending each start/end pair to a set of processes.
+        for start, end in zip(boundaries[:-1], boundaries[1:]):
+            f.seek(start)
+            chunk = f.read(end - start).decode("utf-8", errors="ignore")
+            # Run pre-tokenization on your chunk and store the counts for each pre-token
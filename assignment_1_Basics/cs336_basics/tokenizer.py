@@ -0,0 +1,273 @@
+import os
+import struct
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from functools import partial
+from itertools import chain
+
+import numpy as np
+
+from .bpe import (
+    PAT,
+    _atomic_write,
+    _pack_vocab,
+    _unpack_vocab,
+    apply_merge_ranks,
+    build_merge_ranks,
+    special_token_pattern,
+)
+
+# Characters `Tokenizer.encode_iterable` buffers before encoding
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+# Binary tokenizer files are a fixed header (magic, vocab entries, blob bytes, merges)
+# followed by the token ids (int64), the blob offsets (int64), the merges as
+# (left id, right id, merged id) triples (uint32) and finally the bytes of every
+# token back to back
+TOKENIZER_FILE_MAGIC = b"BPEVOCB2"
+TOKENIZER_FILE_HEADER = struct.Struct("<8sQQQ")
+
+
+def save_tokenizer_binary(path: str | os.PathLike, vocab: dict[int, bytes],
+                          merges: list[tuple[bytes, bytes]]) -> None:
+    token_to_id = {token: token_id for token_id, token in vocab.items()}
+    ids, offsets, blob = _pack_vocab(vocab)
+    merge_ids = np.asarray([(token_to_id[a], token_to_id[b], token_to_id[a + b]) for a, b in merges],
+                           dtype=np.uint32).reshape(-1, 3)
+
+    with _atomic_write(path) as f:
+        f.write(TOKENIZER_FILE_HEADER.pack(TOKENIZER_FILE_MAGIC, ids.size, blob.size, len(merge_ids)))
+        for section in (ids, offsets, merge_ids, blob):
+            f.write(section.tobytes())
+
+
+def _read_tokenizer_binary(path: str | os.PathLike) -> tuple[dict[int, bytes], list[list[int]]]:
+    """
+    The vocab and the (left id, right id, merged id) merge triples of a file
+    written by `save_tokenizer_binary`.
+
+    The file is memory-mapped and each section is converted in bulk (one
+    `tobytes` for the blob, one `tolist` per array) instead of being parsed. The
+    vocab dict is still built per process; only the file pages are shared
+    through the OS cache while they are read.
+    """
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    magic, num_tokens, blob_size, num_merges = TOKENIZER_FILE_HEADER.unpack(data[:TOKENIZER_FILE_HEADER.size])
+    if magic != TOKENIZER_FILE_MAGIC:
+        raise ValueError(f"{path} is not a binary tokenizer file")
+
+    sections = {}
+    start = TOKENIZER_FILE_HEADER.size
+    for name, dtype, count in (("ids", np.int64, num_tokens), ("offsets", np.int64, num_tokens + 1),
+                               ("merge_ids", np.uint32, 3 * num_merges), ("blob", np.uint8, blob_size)):
+        end = start + count * np.dtype(dtype).itemsize
+        sections[name] = data[start:end].view(dtype)
+        start = end
+
+    vocab = _unpack_vocab(sections["ids"], sections["offsets"], sections["blob"])
+    return vocab, sections["merge_ids"].reshape(-1, 3).tolist()
+
+
+def load_tokenizer_binary(path: str | os.PathLike) -> tuple[dict[int, bytes], list[tuple[bytes, bytes]]]:
+    # The `vocab` and `merges` written by `save_tokenizer_binary`
+    vocab, merge_ids = _read_tokenizer_binary(path)
+    return vocab, [(vocab[left], vocab[right]) for left, right, _ in merge_ids]
+
+
+class PretokenCache:
+    """
+    Bounded LRU map from a pretoken to its token ids, with hit/miss counters.
+
+    Natural text repeats a few thousand pretokens over and over, so caching their
+    encodings leaves regex matching as the main cost of `Tokenizer.encode`.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, pretoken: str) -> tuple[int, ...] | None:
+        ids = self.entries.get(pretoken)
+        if ids is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(pretoken)
+        self.hits += 1
+        return ids
+
+    def put(self, pretoken: str, ids: tuple[int, ...]) -> None:
+        if self.maxsize <= 0:
+            return
+        self.entries[pretoken] = ids
+        self.entries.move_to_end(pretoken)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class Tokenizer:
+    """
+    Byte-level BPE tokenizer built from the `vocab` and `merges` returned by `train_bpe`.
+
+    Merges are applied by rank rather than replayed in order: each pretoken starts
+    as byte ids and repeatedly merges its lowest-ranked adjacent pair until no
+    pair in it has a rank. Special tokens are matched before pretokenization and
+    always map to a single id; ones already in `vocab` (as laid out by
+    `init_vocab`) keep their id, others are appended.
+
+    Encoded pretokens are memoised in an LRU cache of `cache_size` entries
+    (0 disables it); `cache.hits` / `cache.misses` show how well it is doing.
+    """
+
+    def __init__(self, vocab: dict[int, bytes], merges: list[tuple[bytes, bytes]],
+                 special_tokens: list[str] | None = None, cache_size: int = 10_000):
+        self.cache = PretokenCache(cache_size)
+        self.vocab = dict(vocab)
+        self.token_to_id = {token: token_id for token_id, token in self.vocab.items()}
+
+        self.special_tokens = {}
+        for token in special_tokens or []:
+            token_bytes = token.encode("utf-8")
+            if token_bytes not in self.token_to_id:
+                token_id = max(self.vocab) + 1
+                self.vocab[token_id] = token_bytes
+                self.token_to_id[token_bytes] = token_id
+            self.special_tokens[token] = self.token_to_id[token_bytes]
+
+        self.special_pattern = special_token_pattern(self.special_tokens)
+        # Needed by streaming encoding to hold back text that might complete a special token
+        self.special_prefixes = {token[:k] for token in self.special_tokens for k in range(1, len(token))}
+        self.max_special_len = max(map(len, self.special_tokens), default=0)
+
+        self.byte_ids = [self.token_to_id[bytes([b])] for b in range(256)]
+
+        # (left id, right id) -> (rank, merged id)
+        self.merge_ranks = build_merge_ranks(self.token_to_id, merges)
+
+    @classmethod
+    def from_binary(cls, path: str | os.PathLike, special_tokens: list[str] | None = None, **kwargs) -> "Tokenizer":
+        # Build a tokenizer from a file written by `save_tokenizer_binary`; the stored
+        # id triples are the merge table already, so merges never go through bytes
+        vocab, merge_ids = _read_tokenizer_binary(path)
+        tokenizer = cls(vocab, [], special_tokens, **kwargs)
+        for rank, (left, right, merged_id) in enumerate(merge_ids):
+            tokenizer.merge_ranks.setdefault((left, right), (rank, merged_id))
+        return tokenizer
+
+    def _encode_pretoken(self, pretoken: bytes) -> list[int]:
+        byte_ids = self.byte_ids
+        return apply_merge_ranks([byte_ids[b] for b in pretoken], self.merge_ranks)
+
+    def _encode_cached(self, pretoken: str) -> tuple[int, ...]:
+        pretoken_ids = self.cache.get(pretoken)
+        if pretoken_ids is None:
+            pretoken_ids = tuple(self._encode_pretoken(pretoken.encode("utf-8")))
+            self.cache.put(pretoken, pretoken_ids)
+        return pretoken_ids
+
+    def _encode_ordinary(self, text: str) -> list[int]:
+        # Encode text that contains no special tokens
+        ids = []
+        for match in PAT.finditer(text):
+            ids.extend(self._encode_cached(match.group()))
+        return ids
+
+    def _encode_settled(self, text: str) -> tuple[list[int], str]:
+        """
+        Encode the part of `text` that cannot change when more text is appended.
+
+        Returns the ids and the held-back tail, which is the last two pretokens
+        plus any suffix that is a proper prefix of a special token (it may still
+        complete into one). The last pretoken may still grow, e.g. a run of letters
+        or whitespace, and the one before it may still merge with it: `'` + `l`
+        becomes the contraction `'ll` once another `l` arrives.
+        """
+        limit = len(text)
+        for k in range(min(len(text), self.max_special_len - 1), 0, -1):
+            if text[limit - k:] in self.special_prefixes:
+                limit -= k
+                break
+
+        parts = self.special_pattern.split(text) if self.special_pattern else [text]
+        ids = []
+        start = 0
+        for i, part in enumerate(parts):
+            end = start + len(part)
+            if i % 2:
+                # a special token reaching into the held-back suffix may still grow
+                if end > limit:
+                    return ids, text[start:]
+                ids.append(self.special_tokens[part])
+            elif end >= limit:
+                # last ordinary text before the limit: hold back its final two pretokens
+                held = []
+                for match in PAT.finditer(part, 0, limit - start):
+                    if len(held) == 2:
+                        ids.extend(self._encode_cached(held.pop(0).group()))
+                    held.append(match)
+                held_from = start + held[0].start() if held else limit
+                return ids, text[held_from:]
+            elif part:
+                ids.extend(self._encode_ordinary(part))
+            start = end
+
+    def encode_chunks(self, iterable: Iterable[str], buffer_size: int = DEFAULT_BUFFER_SIZE) -> Iterator[list[int]]:
+        # Buffer about `buffer_size` characters at a time and encode whatever is settled
+        if hasattr(iterable, "read"):
+            first = iterable.read(buffer_size)
+            # a binary handle would never hit the "" sentinel below
+            if not isinstance(first, str):
+                raise TypeError(f"expected a text file handle, got one that reads {type(first).__name__}")
+            iterable = chain([first], iter(partial(iterable.read, buffer_size), ""))
+
+        pending = []
+        pending_len = 0
+        for text in iterable:
+            pending.append(text)
+            pending_len += len(text)
+            if pending_len >= buffer_size:
+                ids, rest = self._encode_settled("".join(pending))
+                pending = [rest]
+                pending_len = len(rest)
+                if ids:
+                    yield ids
+
+        ids = self.encode("".join(pending))
+        if ids:
+            yield ids
+
+    def encode(self, text: str) -> list[int]:
+        if self.special_pattern is None:
+            return self._encode_ordinary(text)
+
+        ids = []
+        # with a capturing group, odd positions of the split are the special tokens themselves
+        for i, part in enumerate(self.special_pattern.split(text)):
+            if i % 2:
+                ids.append(self.special_tokens[part])
+            elif part:
+                ids.extend(self._encode_ordinary(part))
+        return ids
+
+    def encode_iterable(self, iterable: Iterable[str], buffer_size: int = DEFAULT_BUFFER_SIZE) -> Iterator[int]:
+        """
+        Lazily encode an iterable of strings (e.g. the lines of a file) or a text file handle.
+
+        At most about `buffer_size` characters are held at once, and the ids are the
+        same as `encode` on the concatenated text: pretokens and special tokens cut
+        by a chunk edge are carried over to the next buffer instead of being split.
+        """
+        for ids in self.encode_chunks(iterable, buffer_size):
+            yield from ids
+
+    def decode(self, ids: list[int]) -> str:
+        return b"".join(self.vocab[token_id] for token_id in ids).decode("utf-8", errors="replace")
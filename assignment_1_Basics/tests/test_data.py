@@ -0,0 +1,145 @@
+from collections import Counter
+
+import numpy as np
+import pytest
+import torch
+
+from cs336_basics import data
+from cs336_basics.data import (
+    BatchPrefetcher,
+    TokenFileWriter,
+    encode_file_parallel,
+    encode_to_token_file,
+    get_batch,
+    load_token_file,
+    tokenizer_vocab_size,
+)
+
+from .adapters import get_tokenizer, run_get_batch, run_train_bpe
+from .common import FIXTURES_PATH
+
+
+def test_token_file_grows_and_roundtrips(tmp_path):
+    path = tmp_path / "tokens.bin"
+    ids = np.arange(1000) % 700
+    with TokenFileWriter(path, vocab_size=700, initial_capacity=16) as writer:
+        for start in range(0, len(ids), 37):
+            writer.write(ids[start:start + 37])
+
+    tokens = load_token_file(path)
+    assert tokens.dtype == np.uint16
+    assert tokens.vocab_size == 700
+    np.testing.assert_array_equal(tokens, ids)
+    assert path.stat().st_size == 32 + 2 * len(ids)
+
+
+def test_token_file_rejects_too_small_dtype(tmp_path):
+    with pytest.raises(ValueError):
+        TokenFileWriter(tmp_path / "tokens.bin", vocab_size=70_000, dtype=np.uint16)
+
+
+def test_encode_to_token_file_matches_encode(tmp_path):
+    vocab, merges = run_train_bpe(FIXTURES_PATH / "corpus.en", vocab_size=400, special_tokens=["<|endoftext|>"])
+    tokenizer = get_tokenizer(vocab, merges, special_tokens=["<|endoftext|>"])
+    with open(FIXTURES_PATH / "corpus.en", encoding="utf-8") as f:
+        expected = tokenizer.encode(f.read())
+
+    out_path = tmp_path / "corpus.bin"
+    with open(FIXTURES_PATH / "corpus.en", encoding="utf-8") as f:
+        num_tokens = encode_to_token_file(tokenizer, f, out_path, buffer_size=1000)
+
+    assert num_tokens == len(expected)
+    np.testing.assert_array_equal(load_token_file(out_path), expected)
+
+
+@pytest.mark.parametrize("num_workers", [1, 3])
+def test_encode_file_parallel_keeps_order(tmp_path, num_workers):
+    with open(FIXTURES_PATH / "corpus.en", encoding="utf-8") as f:
+        text = "<|endoftext|>".join(f.read().split("\n"))
+    input_path = tmp_path / "corpus_with_specials.txt"
+    input_path.write_text(text, encoding="utf-8")
+
+    vocab, merges = run_train_bpe(input_path, vocab_size=400, special_tokens=["<|endoftext|>"])
+    tokenizer = get_tokenizer(vocab, merges, special_tokens=["<|endoftext|>"])
+
+    out_path = tmp_path / "corpus.bin"
+    stats = encode_file_parallel(
+        input_path, out_path, vocab, merges, ["<|endoftext|>"], num_workers=num_workers, chunk_size=4096
+    )
+    expected = tokenizer.encode(text)
+    assert stats.num_tokens == len(expected)
+    assert stats.bytes_per_token == pytest.approx(input_path.stat().st_size / len(expected))
+    tokens = load_token_file(out_path)
+    np.testing.assert_array_equal(tokens, expected)
+    assert tokens.vocab_size == max(tokenizer.vocab) + 1
+    assert tokenizer_vocab_size(vocab, ["<|endoftext|>", "<pad>"]) == max(tokenizer.vocab) + 2
+    # nothing is left behind: no temporary shards, and no mapping or tokenizer in this process
+    assert data._worker_mapped is None and data._worker_tokenizer is None
+    assert {p.name for p in tmp_path.iterdir()} == {"corpus_with_specials.txt", "corpus.bin"}
+
+    # a cut must not fall between the halves of a doubled special token
+    special_tokens = ["<|endoftext|>", "<|endoftext|><|endoftext|>"]
+    text = "".join(f"doc {i} hello world<|endoftext|><|endoftext|>" for i in range(500))
+    input_path.write_text(text, encoding="utf-8")
+    encode_file_parallel(input_path, out_path, vocab, merges, special_tokens, num_workers=num_workers,
+                         chunk_size=1000)
+    expected = get_tokenizer(vocab, merges, special_tokens=special_tokens).encode(text)
+    np.testing.assert_array_equal(load_token_file(out_path), expected)
+
+
+def test_get_batch_from_token_file(tmp_path):
+    path = tmp_path / "tokens.bin"
+    with TokenFileWriter(path, vocab_size=10_000) as writer:
+        writer.write(np.arange(10_000))
+    tokens = load_token_file(path)
+
+    context_length = 7
+    x, y = get_batch(tokens, batch_size=64, context_length=context_length, device="cpu",
+                     rng=np.random.default_rng(0))
+    assert x.shape == y.shape == (64, context_length)
+    assert x.dtype == y.dtype == torch.long
+    # every row is a contiguous window and y is x shifted by one
+    np.testing.assert_array_equal(x.numpy(), x[:, :1].numpy() + np.arange(context_length))
+    np.testing.assert_array_equal(y.numpy(), x.numpy() + 1)
+    assert int(x.min()) >= 0 and int(y.max()) < len(tokens)
+
+    # the same generator state gives the same batch
+    x_again, _ = get_batch(tokens, 64, context_length, "cpu", rng=np.random.default_rng(0))
+    assert torch.equal(x, x_again)
+
+
+def test_get_batch_samples_every_start():
+    dataset = np.arange(0, 100)
+    starts = Counter()
+    for _ in range(200):
+        x, _ = run_get_batch(dataset, batch_size=32, context_length=7, device="cpu")
+        starts.update(x[:, 0].tolist())
+    assert set(starts) == set(range(len(dataset) - 7))
+
+    with pytest.raises((RuntimeError, AssertionError)):
+        run_get_batch(dataset, batch_size=32, context_length=7, device="cuda:99")
+
+
+def test_batch_prefetcher_is_deterministic_and_resumable():
+    dataset = np.arange(5_000)
+    with BatchPrefetcher(dataset, batch_size=8, context_length=16, device="cpu", seed=3, num_steps=6) as loader:
+        batches = list(loader)
+        assert loader.step == 6
+    assert len(batches) == 6
+
+    x, y = get_batch(dataset, 8, 16, "cpu", rng=np.random.default_rng([3, 2]))
+    assert torch.equal(batches[2][0], x) and torch.equal(batches[2][1], y)
+
+    with BatchPrefetcher(dataset, batch_size=8, context_length=16, device="cpu", seed=3, start_step=4,
+                         num_steps=6) as resumed:
+        for (x, y), (x_resumed, y_resumed) in zip(batches[4:], resumed, strict=True):
+            assert torch.equal(x, x_resumed) and torch.equal(y, y_resumed)
+
+
+def test_batch_prefetcher_closes_while_producing():
+    loader = BatchPrefetcher(np.arange(1_000), batch_size=4, context_length=8, device="cpu", prefetch=2)
+    next(loader)
+    loader.close()
+    assert not loader.thread.is_alive()
+    with pytest.raises(StopIteration):
+        next(loader)
@@ -0,0 +1,215 @@
+import math
+
+import pytest
+import torch
+import torch.nn.functional as F
+
+from cs336_basics.model import (
+    MultiHeadSelfAttention,
+    RotaryPositionalEmbedding,
+    scaled_dot_product_attention,
+    tiled_scaled_dot_product_attention,
+)
+
+from .adapters import (
+    run_linear,
+    run_multihead_self_attention,
+    run_multihead_self_attention_with_rope,
+    run_rope,
+    run_scaled_dot_product_attention,
+    run_softmax,
+)
+
+
+def _naive_rope(x, token_positions, theta):
+    # Rotate each (even, odd) pair as a complex number
+    d_k = x.shape[-1]
+    inv_freq = theta ** -(torch.arange(0, d_k, 2, dtype=torch.float64) / d_k)
+    angles = token_positions[..., None].double() * inv_freq
+    pairs = torch.view_as_complex(x.double().unflatten(-1, (d_k // 2, 2)).contiguous())
+    return torch.view_as_real(pairs * torch.polar(torch.ones_like(angles), angles)).flatten(-2).to(x.dtype)
+
+
+def _naive_multihead_self_attention(q_weight, k_weight, v_weight, o_weight, x, num_heads, theta=None,
+                                    token_positions=None):
+    # One head at a time, with separate projections and an explicit causal softmax
+    seq_len = x.shape[-2]
+    d_head = q_weight.shape[0] // num_heads
+    causal = torch.ones(seq_len, seq_len, dtype=torch.bool).tril()
+    heads = []
+    for h in range(num_heads):
+        rows = slice(h * d_head, (h + 1) * d_head)
+        q, k, v = x @ q_weight[rows].T, x @ k_weight[rows].T, x @ v_weight[rows].T
+        if theta is not None:
+            q, k = _naive_rope(q, token_positions, theta), _naive_rope(k, token_positions, theta)
+        scores = (q @ k.transpose(-2, -1) / math.sqrt(d_head)).masked_fill(~causal, float("-inf"))
+        heads.append(torch.softmax(scores, dim=-1) @ v)
+    return torch.cat(heads, dim=-1) @ o_weight.T
+
+
+def test_linear():
+    torch.manual_seed(0)
+    weights, x = torch.randn(5, 3), torch.randn(2, 4, 3)
+    torch.testing.assert_close(run_linear(3, 5, weights, x), x @ weights.T)
+
+
+def test_softmax_is_stable():
+    x = torch.tensor([[1.0, 2.0, 3.0], [1000.0, 1001.0, 1002.0]])
+    out = run_softmax(x, dim=-1)
+    torch.testing.assert_close(out[0], out[1])
+    torch.testing.assert_close(out, torch.softmax(x, dim=-1))
+
+
+def test_scaled_dot_product_attention_matches_torch():
+    torch.manual_seed(0)
+    Q, K, V = torch.randn(2, 3, 5, 8), torch.randn(2, 3, 7, 8), torch.randn(2, 3, 7, 4)
+    mask = torch.rand(5, 7) > 0.3
+    mask[:, 0] = True
+    expected = F.scaled_dot_product_attention(Q, K, V, attn_mask=mask)
+    torch.testing.assert_close(run_scaled_dot_product_attention(Q, K, V, mask), expected)
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 16, 256])
+@pytest.mark.parametrize("num_queries, num_keys", [(20, 20), (7, 19), (19, 7)])
+def test_tiled_attention_matches_dense(block_size, num_queries, num_keys):
+    torch.manual_seed(0)
+    Q, K, V = torch.randn(2, 3, num_queries, 8), torch.randn(2, 3, num_keys, 8), torch.randn(2, 3, num_keys, 4)
+    mask = torch.rand(2, 1, num_queries, num_keys) > 0.5
+    mask[..., 0] = True
+
+    dense = scaled_dot_product_attention(Q, K, V, mask)
+    torch.testing.assert_close(tiled_scaled_dot_product_attention(Q, K, V, mask, block_size=block_size), dense)
+
+    causal = torch.ones(num_queries, num_keys, dtype=torch.bool).tril()
+    torch.testing.assert_close(
+        tiled_scaled_dot_product_attention(Q, K, V, is_causal=True, block_size=block_size),
+        scaled_dot_product_attention(Q, K, V, causal),
+    )
+    torch.testing.assert_close(
+        tiled_scaled_dot_product_attention(Q, K, V, mask, is_causal=True, block_size=block_size),
+        scaled_dot_product_attention(Q, K, V, causal & mask),
+    )
+
+
+def test_tiled_attention_fully_masked_rows_and_dtype():
+    torch.manual_seed(0)
+    Q, K, V = (torch.randn(4, 6, 8, dtype=torch.bfloat16) for _ in range(3))
+    mask = torch.ones(6, 6, dtype=torch.bool)
+    mask[2] = False
+    out = tiled_scaled_dot_product_attention(Q, K, V, mask, block_size=4)
+    assert out.dtype == torch.bfloat16
+    assert out[:, 2].isnan().all() and not out[:, [0, 1, 3, 4, 5]].isnan().any()
+    expected = scaled_dot_product_attention(Q.float(), K.float(), V.float(), mask)
+    torch.testing.assert_close(out.float(), expected, equal_nan=True, atol=1e-2, rtol=1e-2)
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 16])
+@pytest.mark.parametrize("num_queries, num_keys", [(20, 20), (7, 19), (19, 7)])
+@pytest.mark.parametrize("is_causal", [False, True])
+def test_tiled_attention_gradients_match_dense(block_size, num_queries, num_keys, is_causal):
+    torch.manual_seed(0)
+    shapes = [(2, 3, num_queries, 8), (2, 3, num_keys, 8), (2, 3, num_keys, 4)]
+    tiled_inputs = [torch.randn(shape, dtype=torch.float64, requires_grad=True) for shape in shapes]
+    dense_inputs = [x.detach().clone().requires_grad_() for x in tiled_inputs]
+    # broadcast over heads, with every query able to attend key 0
+    mask = torch.rand(2, 1, num_queries, num_keys) > 0.5
+    mask[..., 0] = True
+    dense_mask = mask & torch.ones(num_queries, num_keys, dtype=torch.bool).tril() if is_causal else mask
+    grad_out = torch.randn(2, 3, num_queries, 4, dtype=torch.float64)
+
+    tiled = tiled_scaled_dot_product_attention(*tiled_inputs, mask, is_causal=is_causal, block_size=block_size)
+    tiled.backward(grad_out)
+    scaled_dot_product_attention(*dense_inputs, dense_mask).backward(grad_out)
+    for tiled, dense in zip(tiled_inputs, dense_inputs):
+        torch.testing.assert_close(tiled.grad, dense.grad)
+
+
+def test_tiled_attention_backward_skips_fully_masked_rows():
+    torch.manual_seed(0)
+    Q, K, V = (torch.randn(6, 8, requires_grad=True) for _ in range(3))
+    mask = torch.ones(6, 6, dtype=torch.bool)
+    mask[2] = False
+    tiled_scaled_dot_product_attention(Q, K, V, mask, block_size=4)[[0, 1, 3, 4, 5]].sum().backward()
+    assert Q.grad[2].eq(0).all()
+
+    # the other rows get the same gradients as without the masked query
+    rows = [0, 1, 3, 4, 5]
+    Q2, K2, V2 = (x.detach().clone().requires_grad_() for x in (Q, K, V))
+    scaled_dot_product_attention(Q2[rows], K2, V2).sum().backward()
+    torch.testing.assert_close(Q.grad[rows], Q2.grad[rows])
+    torch.testing.assert_close(K.grad, K2.grad)
+    torch.testing.assert_close(V.grad, V2.grad)
+
+
+@pytest.mark.parametrize("batch_shape", [(), (2,), (2, 3)])
+def test_multihead_self_attention_matches_naive(batch_shape):
+    torch.manual_seed(0)
+    d_model, num_heads, seq_len = 32, 4, 10
+    q_weight, k_weight, v_weight, o_weight = (torch.randn(d_model, d_model) / math.sqrt(d_model) for _ in range(4))
+    x = torch.randn(*batch_shape, seq_len, d_model)
+
+    out = run_multihead_self_attention(d_model, num_heads, q_weight, k_weight, v_weight, o_weight, x)
+    expected = _naive_multihead_self_attention(q_weight, k_weight, v_weight, o_weight, x, num_heads)
+    assert out.shape == (*batch_shape, seq_len, d_model)
+    torch.testing.assert_close(out, expected, atol=1e-5, rtol=1e-5)
+
+
+def test_multihead_self_attention_fuses_separate_state_dict_keys():
+    attn = MultiHeadSelfAttention(d_model=16, num_heads=2)
+    assert set(attn.state_dict()) == {"qkv_proj.weight", "output_proj.weight"}
+
+    weights = {f"{name}.weight": torch.randn(16, 16) for name in ("q_proj", "k_proj", "v_proj", "output_proj")}
+    attn.load_state_dict(weights)
+    fused = torch.cat([weights["q_proj.weight"], weights["k_proj.weight"], weights["v_proj.weight"]])
+    torch.testing.assert_close(attn.qkv_proj.weight, fused)
+
+    # nested under a prefix, as in a transformer block checkpoint
+    block = torch.nn.Module()
+    block.attn = MultiHeadSelfAttention(d_model=16, num_heads=2)
+    block.load_state_dict({f"attn.{key}": value for key, value in weights.items()})
+    torch.testing.assert_close(block.attn.qkv_proj.weight, attn.qkv_proj.weight)
+
+    # the fused layout saved by the module loads back as is
+    clone = MultiHeadSelfAttention(d_model=16, num_heads=2)
+    clone.load_state_dict(attn.state_dict())
+    torch.testing.assert_close(clone.qkv_proj.weight, attn.qkv_proj.weight)
+
+
+def test_rope_matches_complex_rotation():
+    torch.manual_seed(0)
+    x = torch.randn(2, 3, 12, 16)
+    token_positions = torch.randint(0, 59, (2, 1, 12))
+    out = run_rope(16, 10000.0, 64, x, token_positions)
+    torch.testing.assert_close(out, _naive_rope(x, token_positions, 10000.0), atol=1e-5, rtol=1e-5)
+    # relative positions are all that matters for q . k
+    shifted = run_rope(16, 10000.0, 64, x, token_positions + 5)
+    torch.testing.assert_close(out @ out.transpose(-2, -1), shifted @ shifted.transpose(-2, -1), atol=1e-4, rtol=1e-4)
+
+
+def test_rope_tables_are_shared():
+    first = RotaryPositionalEmbedding(10000.0, 16, 128)
+    second = RotaryPositionalEmbedding(10000.0, 16, 128)
+    assert first.cos is second.cos and first.sin is second.sin
+    assert RotaryPositionalEmbedding(500.0, 16, 128).cos is not first.cos
+    assert "cos" not in first.state_dict()
+
+
+def test_multihead_self_attention_with_rope_matches_naive():
+    torch.manual_seed(0)
+    d_model, num_heads, seq_len = 32, 4, 10
+    q_weight, k_weight, v_weight, o_weight = (torch.randn(d_model, d_model) / math.sqrt(d_model) for _ in range(4))
+    x = torch.randn(2, seq_len, d_model)
+    token_positions = torch.arange(seq_len).expand(2, seq_len) + torch.tensor([[0], [7]])
+
+    out = run_multihead_self_attention_with_rope(
+        d_model, num_heads, 32, 10000.0, q_weight, k_weight, v_weight, o_weight, x, token_positions
+    )
+    expected = _naive_multihead_self_attention(
+        q_weight, k_weight, v_weight, o_weight, x, num_heads, theta=10000.0, token_positions=token_positions
+    )
+    torch.testing.assert_close(out, expected, atol=1e-5, rtol=1e-5)
+
+    # without positions, tokens sit at 0..seq_len-1
+    out = run_multihead_self_attention_with_rope(d_model, num_heads, 32, 10000.0, q_weight, k_weight, v_weight,
+                                                 o_weight, x)
+    torch.testing.assert_close(out[0], expected[0], atol=1e-5, rtol=1e-5)
@@ -0,0 +1,149 @@
+import io
+
+import pytest
+
+from cs336_basics.tokenizer import PretokenCache, Tokenizer, load_tokenizer_binary, save_tokenizer_binary
+
+from .adapters import get_tokenizer, run_train_bpe
+from .common import FIXTURES_PATH
+
+SAMPLES = [
+    "",
+    "s",
+    "Hello, how are you?",
+    "Héllò hôw <|endoftext|><|endoftext|> are ü? 🙃",
+    "the quick brown fox<|endoftext|>jumps over\n\nthe lazy dog  ",
+]
+
+
+@pytest.fixture(scope="module")
+def trained():
+    return run_train_bpe(
+        input_path=FIXTURES_PATH / "corpus.en",
+        vocab_size=500,
+        special_tokens=["<|endoftext|>"],
+    )
+
+
+def _replay_merges(vocab, merges, pretoken: bytes) -> list[int]:
+    # Reference encoder: apply every merge in creation order
+    token_to_id = {token: token_id for token_id, token in vocab.items()}
+    parts = [bytes([b]) for b in pretoken]
+    for left, right in merges:
+        merged = []
+        i = 0
+        while i < len(parts):
+            if i + 1 < len(parts) and parts[i] == left and parts[i + 1] == right:
+                merged.append(left + right)
+                i += 2
+            else:
+                merged.append(parts[i])
+                i += 1
+        parts = merged
+    return [token_to_id[part] for part in parts]
+
+
+@pytest.mark.parametrize("text", SAMPLES)
+def test_roundtrip(trained, text):
+    vocab, merges = trained
+    tokenizer = get_tokenizer(vocab, merges, special_tokens=["<|endoftext|>"])
+    assert tokenizer.decode(tokenizer.encode(text)) == text
+
+
+def test_rank_merging_matches_replaying_merges(trained):
+    vocab, merges = trained
+    tokenizer = get_tokenizer(vocab, merges)
+    for word in [b" the", b" lowest", b"aaaaaaa", b" tokenization", "Ünïcödé".encode("utf-8")]:
+        assert tokenizer._encode_pretoken(word) == _replay_merges(vocab, merges, word)
+
+
+def test_special_tokens_keep_their_vocab_ids(trained):
+    vocab, merges = trained
+    tokenizer = get_tokenizer(vocab, merges, special_tokens=["<|endoftext|>"])
+    eot_id = next(token_id for token_id, token in vocab.items() if token == b"<|endoftext|>")
+    ids = tokenizer.encode("a<|endoftext|>b")
+    assert ids.count(eot_id) == 1
+    assert tokenizer.decode([eot_id]) == "<|endoftext|>"
+
+
+def test_overlapping_special_tokens(trained):
+    vocab, merges = trained
+    special_tokens = ["<|endoftext|>", "<|endoftext|><|endoftext|>"]
+    tokenizer = get_tokenizer(vocab, merges, special_tokens=special_tokens)
+    ids = tokenizer.encode("x<|endoftext|><|endoftext|><|endoftext|>y")
+    tokenized = [tokenizer.decode([token_id]) for token_id in ids]
+    assert tokenized.count("<|endoftext|><|endoftext|>") == 1
+    assert tokenized.count("<|endoftext|>") == 1
+
+
+def test_encode_iterable_matches_encode(trained):
+    vocab, merges = trained
+    tokenizer = get_tokenizer(vocab, merges, special_tokens=["<|endoftext|>"])
+    with open(FIXTURES_PATH / "corpus.en", encoding="utf-8") as f:
+        text = f.read()
+    with open(FIXTURES_PATH / "corpus.en", encoding="utf-8") as f:
+        assert list(tokenizer.encode_iterable(f)) == tokenizer.encode(text)
+
+    # binary handles return b"" at the end, which must not be taken for more text
+    with pytest.raises(TypeError):
+        list(tokenizer.encode_iterable(io.BytesIO(b"hello world")))
+
+
+def test_pretoken_cache_is_bounded_and_transparent(trained):
+    vocab, merges = trained
+    with open(FIXTURES_PATH / "corpus.en", encoding="utf-8") as f:
+        text = f.read()
+
+    uncached = Tokenizer(vocab, merges, special_tokens=["<|endoftext|>"], cache_size=0)
+    cached = Tokenizer(vocab, merges, special_tokens=["<|endoftext|>"], cache_size=64)
+    assert cached.encode(text) == uncached.encode(text)
+    assert len(uncached.cache) == 0
+    assert len(cached.cache) == 64
+    assert cached.cache.hits > 0
+    assert cached.cache.hits + cached.cache.misses == uncached.cache.misses
+
+
+def test_pretoken_cache_evicts_least_recently_used():
+    cache = PretokenCache(maxsize=2)
+    cache.put("a", (1,))
+    cache.put("b", (2,))
+    assert cache.get("a") == (1,)
+    cache.put("c", (3,))
+    assert cache.get("b") is None
+    assert cache.get("a") == (1,)
+    assert cache.get("c") == (3,)
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+@pytest.mark.parametrize("buffer_size", [1, 3, 7, 64])
+def test_encode_iterable_does_not_split_at_buffer_edges(trained, buffer_size):
+    vocab, merges = trained
+    special_tokens = ["<|endoftext|>", "<|endoftext|><|endoftext|>"]
+    tokenizer = get_tokenizer(vocab, merges, special_tokens=special_tokens)
+    text = "".join(SAMPLES) + "\n\n\n   <|endoftext|>hello<|endoftext|><|endoftext|>world  \n"
+    pieces = [text[i:i + 5] for i in range(0, len(text), 5)]
+    assert list(tokenizer.encode_iterable(pieces, buffer_size=buffer_size)) == tokenizer.encode(text)
+    assert list(tokenizer.encode_iterable(io.StringIO(text), buffer_size=buffer_size)) == tokenizer.encode(text)
+
+    # a buffer edge inside a contraction must not split it into `'` + letters
+    for word in ["they'lly", "we've", "you're", "it's", "I'll"]:
+        for cut in range(1, len(word)):
+            pieces = [word[:cut], word[cut:], " ok"]
+            assert list(tokenizer.encode_iterable(pieces, buffer_size=buffer_size)) == tokenizer.encode("".join(pieces))
+
+
+def test_binary_serialization_roundtrip(trained, tmp_path):
+    vocab, merges = trained
+    path = tmp_path / "tokenizer.bin"
+    save_tokenizer_binary(path, vocab, merges)
+    assert load_tokenizer_binary(path) == (vocab, merges)
+
+    tokenizer = Tokenizer.from_binary(path, special_tokens=["<|endoftext|>"])
+    reference = get_tokenizer(vocab, merges, special_tokens=["<|endoftext|>"])
+    assert tokenizer.merge_ranks == reference.merge_ranks
+    for text in SAMPLES:
+        assert tokenizer.encode(text) == reference.encode(text)
+
+    (tmp_path / "not_a_tokenizer.bin").write_bytes(b"\0" * 64)
+    with pytest.raises(ValueError):
+        load_tokenizer_binary(tmp_path / "not_a_tokenizer.bin")
@@ -1,5 +1,21 @@
 import json
+import mmap
 import time
+from array import array
+from collections import Counter, defaultdict
+
+import pytest
+
+from cs336_basics import bpe
+from cs336_basics.bpe import (
+    TrainingMonitor,
+    count_pairs,
+    count_pretokens,
+    split_special_tokens,
+    train_bpe,
+    train_bpe_from_file,
+)
+from cs336_basics.pretokenization_example import find_chunk_boundaries, find_chunk_boundaries_mmap
 
 from .adapters import run_train_bpe
 from .common import FIXTURES_PATH, gpt2_bytes_to_unicode
@@ -87,3 +103,212 @@ def test_train_bpe_special_tokens(snapshot):
             "merges": merges,
         },
     )
+
+
+def test_train_bpe_chunked_file_matches_in_memory(tmp_path):
+    """
+    Reading the corpus in small special-token-aligned chunks must give the same
+    merges as training on the whole text at once.
+    """
+    with open(FIXTURES_PATH / "corpus.en", encoding="utf-8") as f:
+        text = "<|endoftext|>".join(f.read().split("\n"))
+    input_path = tmp_path / "corpus_with_specials.txt"
+    input_path.write_text(text, encoding="utf-8")
+
+    vocab, merges = train_bpe(text, vocab_size=300, special_tokens=["<|endoftext|>"])
+    chunked_vocab, chunked_merges = train_bpe_from_file(
+        input_path, vocab_size=300, special_tokens=["<|endoftext|>"], chunk_size=4096
+    )
+    assert chunked_merges == merges
+    assert chunked_vocab == vocab
+
+
+def test_train_bpe_parallel_pretokenization_matches_serial(tmp_path):
+    with open(FIXTURES_PATH / "corpus.en", encoding="utf-8") as f:
+        text = "<|endoftext|>".join(f.read().split("\n"))
+    input_path = tmp_path / "corpus_with_specials.txt"
+    input_path.write_text(text, encoding="utf-8")
+
+    serial = train_bpe_from_file(input_path, vocab_size=300, special_tokens=["<|endoftext|>"])
+    parallel = train_bpe_from_file(
+        input_path, vocab_size=300, special_tokens=["<|endoftext|>"], num_workers=4, chunk_size=4096
+    )
+    in_memory = train_bpe(text, vocab_size=300, special_tokens=["<|endoftext|>"], num_workers=4)
+    assert parallel == serial
+    assert in_memory == serial
+
+
+def test_count_pairs_matches_python_loop():
+    words = [array("I", list(word)) for word in (b"hello", b" world", b"aaaa", b"a", b"", b"abab")]
+    word_freqs = [3, 2, 5, 7, 1, 4]
+    pair_freqs, pair_to_words = count_pairs(words, word_freqs)
+
+    expected_freqs = Counter()
+    expected_index = defaultdict(set)
+    for word_id, (word, freq) in enumerate(zip(words, word_freqs)):
+        for pair in zip(word, word[1:]):
+            expected_freqs[pair] += freq
+            expected_index[pair].add(word_id)
+    assert pair_freqs == expected_freqs
+    assert pair_to_words == expected_index
+
+
+def test_train_bpe_monitor_reports_progress():
+    reports = []
+    monitor = TrainingMonitor(callback=reports.append, report_every=50)
+    _, merges = train_bpe_from_file(
+        FIXTURES_PATH / "corpus.en", vocab_size=500, special_tokens=["<|endoftext|>"], monitor=monitor
+    )
+
+    assert [r.merges_done for r in reports if r.phase == "merge"] == [50, 100, 150, 200, len(merges)]
+    final = reports[-1]
+    assert final.merges_total == len(merges)
+    assert set(final.phase_seconds) == {"pretokenize", "count_pairs", "merge"}
+    assert final.num_pretokens > 0 and final.num_pairs > 0
+    assert final.eta_seconds == 0
+
+    # report_every=0 keeps the phase reports only
+    reports.clear()
+    train_bpe_from_file(
+        FIXTURES_PATH / "corpus.en", vocab_size=300, special_tokens=["<|endoftext|>"],
+        monitor=TrainingMonitor(callback=reports.append, report_every=0),
+    )
+    assert [r.phase for r in reports] == ["pretokenize", "count_pairs", "merge"]
+    with pytest.raises(ValueError):
+        TrainingMonitor(report_every=-1)
+
+
+def test_train_bpe_resumes_from_checkpoint(tmp_path):
+    input_path = FIXTURES_PATH / "corpus.en"
+    checkpoint_path = tmp_path / "bpe_state.npz"
+    vocab, merges = train_bpe_from_file(
+        input_path, vocab_size=500, special_tokens=["<|endoftext|>"],
+        checkpoint_path=checkpoint_path, checkpoint_every=100,
+    )
+
+    # the last snapshot was taken after 200 merges; resuming must not need the corpus
+    reports = []
+    resumed_vocab, resumed_merges = train_bpe_from_file(
+        tmp_path / "missing.txt", vocab_size=500, special_tokens=["<|endoftext|>"], resume_from=checkpoint_path,
+        monitor=TrainingMonitor(callback=reports.append),
+    )
+    assert resumed_merges == merges
+    assert resumed_vocab == vocab
+    # the merge rate counts only the merges made after resuming
+    final = reports[-1]
+    assert final.merges_per_sec * final.phase_seconds["merge"] == pytest.approx(len(merges) - 200)
+
+
+def test_train_bpe_reuses_cached_pretoken_table(tmp_path, monkeypatch):
+    input_path = FIXTURES_PATH / "corpus.en"
+    cache_dir = tmp_path / "cache"
+    vocab, merges = train_bpe_from_file(input_path, vocab_size=500, special_tokens=["<|endoftext|>"], cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the corpus should not be pretokenized again")
+
+    with monkeypatch.context() as m:
+        m.setattr(bpe, "count_pretokens_from_file", fail)
+        cached_vocab, cached_merges = train_bpe_from_file(
+            input_path, vocab_size=500, special_tokens=["<|endoftext|>"], cache_dir=cache_dir
+        )
+    assert (cached_vocab, cached_merges) == (vocab, merges)
+
+    # different special tokens need a different table
+    train_bpe_from_file(input_path, vocab_size=300, special_tokens=["<|endoftext|>", "<pad>"], cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 2
+
+
+def test_train_bpe_extends_existing_vocab():
+    input_path = FIXTURES_PATH / "corpus.en"
+    special_tokens = ["<|endoftext|>"]
+    small_vocab, small_merges = train_bpe_from_file(input_path, vocab_size=300, special_tokens=special_tokens)
+    vocab, merges = train_bpe_from_file(input_path, vocab_size=500, special_tokens=special_tokens)
+
+    extended_vocab, extended_merges = train_bpe_from_file(
+        input_path, vocab_size=500, special_tokens=special_tokens, vocab=small_vocab, merges=small_merges
+    )
+    assert extended_merges[: len(small_merges)] == small_merges
+    assert extended_merges == merges
+    assert extended_vocab == vocab
+
+
+def test_special_tokens_split_in_one_pass():
+    special_tokens = ["<|endoftext|>", "<|endoftext|><|endoftext|>", "<pad>", "<|end"]
+    text = "a<|endoftext|><|endoftext|>b<pad>c<|endoftext|>d<|end e<pad><pad>"
+    assert split_special_tokens(text, special_tokens) == ["a", "b", "c", "d", " e", "", ""]
+    assert split_special_tokens(text, []) == [text]
+
+    counts = count_pretokens(text * 3, special_tokens)
+    assert all(b"<" not in pretoken for pretoken in counts)
+    assert counts[b" e"] == 3
+
+
+@pytest.mark.parametrize("special_tokens", [
+    ["<|eot|>", "[doc]<|eot|>"],
+    ["<|endoftext|>", "<|endoftext|><|endoftext|>"],
+])
+def test_chunked_counts_match_in_memory_with_overlapping_special_tokens(special_tokens, tmp_path):
+    # a chunk boundary must never fall inside a longer special token that contains a shorter one
+    text = "".join(f"doc {i} [doc] hello{special_tokens[1]}world{special_tokens[0]}" for i in range(300))
+    input_path = tmp_path / "corpus.txt"
+    input_path.write_text(text, encoding="utf-8")
+
+    expected = count_pretokens(text, special_tokens)
+    assert bpe.count_pretokens_from_file(input_path, special_tokens, chunk_size=1000) == expected
+    assert bpe.pretokenize_parallel(input_path, special_tokens, 4, chunk_size=1000) == expected
+
+
+@pytest.mark.parametrize("num_chunks", [1, 2, 7, 64])
+def test_mmap_chunk_boundaries_match_file_reads(num_chunks, tmp_path):
+    token = b"<|endoftext|>"
+    lines = (FIXTURES_PATH / "corpus.en").read_bytes().splitlines(keepends=True)
+    input_path = tmp_path / "corpus.txt"
+    input_path.write_bytes(token.join(b"".join(lines[i:i + 50]) for i in range(0, len(lines), 50)))
+    with open(input_path, "rb") as f:
+        expected = find_chunk_boundaries(f, num_chunks, token)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            assert find_chunk_boundaries_mmap(mapped, num_chunks, token) == expected
+            assert all(mapped[b:b + len(token)] == token for b in expected[1:-1])
+
+
+def test_parallel_merge_loop_matches_serial(tmp_path):
+    input_path = FIXTURES_PATH / "corpus.en"
+    vocab, merges = train_bpe_from_file(input_path, vocab_size=500, special_tokens=["<|endoftext|>"])
+    checkpoint_path = tmp_path / "bpe_state.npz"
+    parallel_vocab, parallel_merges = train_bpe_from_file(
+        input_path,
+        vocab_size=500,
+        special_tokens=["<|endoftext|>"],
+        merge_workers=3,
+        checkpoint_path=checkpoint_path,
+        checkpoint_every=100,
+    )
+    assert parallel_merges == merges
+    assert parallel_vocab == vocab
+    # the snapshot gathers the words back from every shard
+    words = bpe.load_bpe_state(checkpoint_path)[0]
+    assert len(words) == len(bpe.count_pretokens_from_file(input_path, ["<|endoftext|>"]))
+
+
+def test_parallel_merge_workers_stop_when_training_fails(tmp_path, monkeypatch):
+    started = []
+    original_init = bpe.MergeShards.__init__
+
+    def tracking_init(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        started.extend(self.processes)
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(bpe.MergeShards, "__init__", tracking_init)
+    monkeypatch.setattr(bpe, "save_bpe_state", fail)
+    with pytest.raises(OSError):
+        train_bpe_from_file(
+            FIXTURES_PATH / "corpus.en", vocab_size=400, special_tokens=["<|endoftext|>"],
+            merge_workers=2, checkpoint_path=tmp_path / "state.npz", checkpoint_every=50,
+        )
+    assert len(started) == 2
+    assert not any(process.is_alive() for process in started)